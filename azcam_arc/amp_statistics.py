@@ -0,0 +1,157 @@
+"""
+Contains the AmpStatistics class.
+"""
+
+import numpy
+
+from .shared_image import get_amp_geometry
+
+
+class AmpStatistics(object):
+    """
+    Per-amplifier statistics accumulated as image data is received.
+    Running sums and a coarse histogram are updated for each new block of pixel groups,
+    so mean, median estimate, overscan bias and saturation counts are ready when the
+    readout finishes without another pass over the image.
+    """
+
+    def __init__(self):
+
+        # True to accumulate statistics during readout
+        self.enabled = 0
+        # pixels at or above this value are counted as saturated
+        self.saturation = 65535
+        # histogram bin width is 2**hist_shift counts, used for the median estimate
+        self.hist_shift = 4
+
+        # number of pixel groups (one pixel from each amplifier) accumulated so far
+        self.groups = 0
+
+        self.numamps = 0
+        self.numcols = 0
+        self.datacols = slice(0, 0)
+        self.datarows = slice(0, 0)
+        self.biascols = slice(0, 0)
+        # image amplifier order of data stream positions
+        self.index_map = numpy.zeros(0, dtype=numpy.intp)
+
+        # accumulators for each data stream position
+        self.data_count = None
+        self.data_sum = None
+        self.bias_count = None
+        self.bias_sum = None
+        self.saturated = None
+        self.histogram = None
+
+    def start(self, focalplane, numamps, numpix_amp, data_order=[]):
+        """
+        Reset accumulators for a new readout.
+        numamps and numpix_amp are for the received data stream.
+        """
+
+        geometry = get_amp_geometry(focalplane, numpix_amp)
+        _, numcols, self.datarows, self.datacols, self.biascols = geometry
+
+        self.numamps = numamps
+        self.numcols = numcols
+        if len(data_order) == 0:
+            self.index_map = numpy.arange(numamps, dtype=numpy.intp)
+        else:
+            self.index_map = numpy.array(data_order, dtype=numpy.intp)
+
+        nbins = (65535 >> self.hist_shift) + 1
+        self.data_count = numpy.zeros(numamps, dtype="int64")
+        self.data_sum = numpy.zeros(numamps, dtype="float64")
+        self.bias_count = numpy.zeros(numamps, dtype="int64")
+        self.bias_sum = numpy.zeros(numamps, dtype="float64")
+        self.saturated = numpy.zeros(numamps, dtype="int64")
+        self.histogram = numpy.zeros((numamps, nbins), dtype="int64")
+        self.groups = 0
+
+        return
+
+    def update(self, buffer, groups):
+        """
+        Accumulate pixel groups received in buffer since the last update.
+        groups is the number of pixel groups received.
+        """
+
+        first = self.groups
+        if groups <= first:
+            return
+
+        block = buffer[first * self.numamps : groups * self.numamps]
+        self.update_block(block.reshape(groups - first, self.numamps), first)
+        self.groups = groups
+
+        return
+
+    def update_block(self, block, first):
+        """
+        Accumulate block, shape [groups, numamps], whose first row is pixel group first.
+        """
+
+        pos = numpy.arange(first, first + block.shape[0])
+        col = pos % self.numcols
+        row = pos // self.numcols
+
+        # serial overscan columns of every row
+        bias = (col >= self.biascols.start) & (col < self.biascols.stop)
+        if bias.any():
+            pixels = block[bias]
+            self.bias_count += pixels.shape[0]
+            self.bias_sum += pixels.sum(axis=0, dtype="float64")
+
+        data = (
+            (col >= self.datacols.start)
+            & (col < self.datacols.stop)
+            & (row >= self.datarows.start)
+            & (row < self.datarows.stop)
+        )
+        if not data.any():
+            return
+
+        pixels = block[data]
+        self.data_count += pixels.shape[0]
+        self.data_sum += pixels.sum(axis=0, dtype="float64")
+        self.saturated += (pixels >= self.saturation).sum(axis=0)
+
+        # one bincount for all amplifiers, each offset into its own histogram
+        # pixels wider than 16 bits are counted in the last bin, floats work as well
+        nbins = self.histogram.shape[1]
+        bins = numpy.floor_divide(pixels, 1 << self.hist_shift)
+        bins = numpy.clip(bins, 0, nbins - 1).astype(numpy.intp)
+        bins += numpy.arange(self.numamps, dtype=numpy.intp) * nbins
+        self.histogram += numpy.bincount(
+            bins.ravel(), minlength=self.numamps * nbins
+        ).reshape(self.numamps, nbins)
+
+        return
+
+    def get_statistics(self):
+        """
+        Return statistics as a dictionary of lists with one value per image amplifier.
+        Keys are numpix, mean, median, bias and saturated.
+        """
+
+        if self.data_count is None:
+            return {}
+
+        count = numpy.maximum(self.data_count, 1)
+        mean = self.data_sum / count
+        bias = self.bias_sum / numpy.maximum(self.bias_count, 1)
+
+        # median is the center of the histogram bin containing the middle pixel
+        cumulative = numpy.cumsum(self.histogram, axis=1)
+        middle = numpy.argmax(cumulative >= (self.data_count[:, None] + 1) // 2, axis=1)
+        median = (middle + 0.5) * (1 << self.hist_shift)
+
+        index_map = self.index_map
+
+        return {
+            "numpix": [int(x) for x in self.data_count[index_map]],
+            "mean": [float(x) for x in mean[index_map]],
+            "median": [float(x) for x in median[index_map]],
+            "bias": [float(x) for x in bias[index_map]],
+            "saturated": [int(x) for x in self.saturated[index_map]],
+        }
@@ -0,0 +1,95 @@
+"""
+Contains the BinaryProtocol class.
+"""
+
+import struct
+
+
+class BinaryProtocol(object):
+    """
+    Compact binary framing of controller server board commands.
+    A client asks for it with the text command "Protocol Binary 1" and uses it only
+    if the reply is OK, otherwise it keeps using text commands.
+    Frames start with MAGIC, which is not a text character, so binary and text
+    commands may be mixed on one connection.
+
+    Request, little-endian, 28 bytes:
+        magic, type, sequence, cmdnum, board, arg1, arg2, arg3, arg4
+    Reply, 8 bytes, followed by value bytes of error message if status is ERROR:
+        magic, status, sequence, value
+    """
+
+    MAGIC = 0xA5
+    VERSION = 1
+
+    # request types
+    BOARD_COMMAND = 1
+
+    # reply status
+    OK = 0
+    ERROR = 1
+
+    REQUEST = struct.Struct("<BBHI5i")
+    REPLY = struct.Struct("<BBHI")
+
+    def __init__(self):
+
+        # sequence number of the last request
+        self.sequence = 0
+
+    def pack_request(self, cmdnum, board, arg1=-1, arg2=-1, arg3=-1, arg4=-1):
+        """
+        Return a board command request frame and its sequence number.
+        """
+
+        self.sequence = (self.sequence + 1) & 0xFFFF
+
+        frame = self.REQUEST.pack(
+            self.MAGIC,
+            self.BOARD_COMMAND,
+            self.sequence,
+            cmdnum,
+            board,
+            arg1,
+            arg2,
+            arg3,
+            arg4,
+        )
+
+        return frame, self.sequence
+
+    @classmethod
+    def unpack_request(cls, frame):
+        """
+        Return (type, sequence, cmdnum, board, arg1, arg2, arg3, arg4) of a request.
+        """
+
+        fields = cls.REQUEST.unpack(frame)
+        if fields[0] != cls.MAGIC:
+            raise ValueError("bad binary request frame")
+
+        return fields[1:]
+
+    @classmethod
+    def pack_reply(cls, sequence, value=0, message=""):
+        """
+        Return a reply frame, an error reply if message is not empty.
+        """
+
+        if message:
+            text = message.encode()
+            return cls.REPLY.pack(cls.MAGIC, cls.ERROR, sequence, len(text)) + text
+
+        return cls.REPLY.pack(cls.MAGIC, cls.OK, sequence, value)
+
+    @classmethod
+    def unpack_reply(cls, frame):
+        """
+        Return (status, sequence, value) of a reply frame.
+        """
+
+        magic, status, sequence, value = cls.REPLY.unpack(frame)
+        if magic != cls.MAGIC:
+            raise ValueError("bad binary reply frame")
+
+        return status, sequence, value
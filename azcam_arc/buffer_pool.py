@@ -0,0 +1,93 @@
+"""
+Contains the BufferPool class.
+"""
+
+import threading
+
+import numpy
+
+
+class BufferPool(object):
+    """
+    Pool of reusable image data buffers keyed on (numpix, dtype).
+    Buffers are pre-faulted when allocated so reuse does not cause page faults.
+    Requesting a buffer with a new key evicts all pooled buffers, which happens
+    when the ROI or binning changes.
+    """
+
+    def __init__(self):
+
+        # (numpix, dtype) of pooled buffers
+        self.key = None
+        # buffers available for reuse
+        self.buffers = []
+
+        # number of requests served from the pool
+        self.hits = 0
+        # number of requests which allocated a new buffer
+        self.misses = 0
+        # number of buffers evicted due to geometry change
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, numpix, dtype="<u2"):
+        """
+        Return a 1D buffer of numpix pixels, reused from the pool if possible.
+        Contents are undefined.
+        """
+
+        key = (int(numpix), numpy.dtype(dtype).str)
+
+        with self.lock:
+            if key != self.key:
+                self.evictions += len(self.buffers)
+                self.buffers = []
+                self.key = key
+
+            if len(self.buffers) > 0:
+                self.hits += 1
+                return self.buffers.pop()
+
+            self.misses += 1
+
+        # touch every page now rather than during the readout
+        buffer = numpy.empty(shape=(key[0]), dtype=key[1])
+        buffer.fill(0)
+
+        return buffer
+
+    def release(self, buffer):
+        """
+        Return a buffer to the pool for reuse.
+        Buffers which do not match the current key are dropped.
+        """
+
+        with self.lock:
+            if (buffer.size, buffer.dtype.str) == self.key:
+                self.buffers.append(buffer)
+
+        return
+
+    def clear(self):
+        """
+        Free all pooled buffers.
+        """
+
+        with self.lock:
+            self.evictions += len(self.buffers)
+            self.buffers = []
+            self.key = None
+
+        return
+
+    def get_counters(self):
+        """
+        Return a dictionary of pool hits, misses, and evictions.
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
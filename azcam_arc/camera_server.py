@@ -2,9 +2,17 @@
 Contains the CameraServerInterface class for ARC controllers.
 """
 
+import shlex
+import struct
+import threading
+import time
+
 import azcam
 import azcam.sockets
 
+from .binary_protocol import BinaryProtocol
+from .command_stats import CommandStats
+
 
 class CameraServerInterface(object):
     """
@@ -20,6 +28,53 @@ class CameraServerInterface(object):
 
         self.demo_mode = 0
 
+        # commands queued while batching, see begin_batch()
+        self.batch = []
+        # begin_batch() nesting depth, 0 when not batching
+        self.batch_depth = 0
+        # maximum number of commands sent in one write
+        self.batch_size = 64
+
+        # True to send status and control commands on their own connections
+        self.use_channels = 0
+        # channel of commands which do not use the main connection
+        self.channel_commands = {
+            "Get PixelCount": "status",
+            "Get ExposureTimeRemaining": "status",
+            "AbortExposure": "control",
+            "AbortReadout": "control",
+            "PauseExposure": "control",
+            "ResumeExposure": "control",
+        }
+        # status and control connections, opened when first used
+        self.channels = {}
+        # one lock per channel so a connection is used by one thread at a time
+        self.channel_locks = {}
+
+        # cache time to live in seconds for parameters read by get(), 0 to keep until
+        # invalidated, parameters not listed are always read from the server
+        self.cache_policy = {
+            "ControllerType": 0,
+            "ExposureTime": 60.0,
+            "NumberPixelsImage": 60.0,
+        }
+        # True to use the parameter cache
+        self.use_cache = 1
+        # cached parameter replies as (reply, time.monotonic()) keyed on parameter
+        self.cache = {}
+
+        # True to ask the controller server for binary board commands when connecting
+        self.binary_protocol = 0
+        # binary frame encoder
+        self.binary = BinaryProtocol()
+        # connection on which the protocol was negotiated, None if not negotiated
+        self.protocol_socket = None
+        # True if binary board commands are used on protocol_socket
+        self.protocol_binary = 0
+
+        # command latency statistics, None when disabled, see enable_command_stats()
+        self.command_stats = None
+
     def set_server(self, host: str, port: int = 2405) -> None:
         """
         Set host and port of camera server.
@@ -31,23 +86,345 @@ class CameraServerInterface(object):
         self.socketserver.host = host
         self.socketserver.port = port
 
+        self.close_channels()
+        self.invalidate_cache()
+
         return
 
     def command(self, command: str, terminator: str = "\n"):
         """
         Command method for controller server.
+        Commands queued by queue() are sent first so replies stay in order.
+        With use_channels, status and control commands listed in channel_commands
+        are sent on their own connections so they do not wait behind other commands.
         """
 
+        channel = self.get_channel(command)
+
+        if channel is None and self.batch:
+            self.flush_batch()
+
         if self.demo_mode:
             reply = ["DEMO", 0]
+        elif channel is None:
+            return self.send_command(self.socketserver, command, terminator)
         else:
+            with self.channel_locks.setdefault(channel, threading.Lock()):
+                socketserver = self.get_channel_socket(channel)
+                return self.send_command(socketserver, command, terminator)
+
+    def send_command(self, socketserver, command: str, terminator: str = "\n"):
+        """
+        Send a command on a connection and return the reply.
+        """
+
+        try:
+            if self.command_stats is None:
+                return socketserver.command(command, terminator)
+            t0 = time.perf_counter()
+            reply = socketserver.command(command, terminator)
+            self.command_stats.record(command, time.perf_counter() - t0)
+            return reply
+        except azcam.AzcamError as e:
+            if e.error_code == 2:
+                raise azcam.AzcamError("Could not connect to camserver")
+
+    def board_command(self, cmdnum, board, arg1=-1, arg2=-1, arg3=-1, arg4=-1):
+        """
+        Send a board command and return the reply like command().
+        With binary_protocol, the protocol is negotiated on each new connection and
+        binary replies have an integer value, otherwise text commands are used.
+        Commands with an argument which is not an integer, such as "VID", are sent
+        as text.
+        """
+
+        args = self.get_integer_args(board, arg1, arg2, arg3, arg4)
+
+        if self.binary_protocol and not self.demo_mode and args is not None:
+            if self.batch:
+                self.flush_batch()
+
+            socket = self.socketserver.socket
+            if socket is None or socket is not self.protocol_socket:
+                self.negotiate_protocol()
+
+            if self.protocol_binary:
+                return self.board_command_binary(cmdnum, *args)
+
+        return self.command(
+            f"BoardCommand {cmdnum} {board} {arg1} {arg2} {arg3} {arg4}"
+        )
+
+    def negotiate_protocol(self):
+        """
+        Ask the controller server for binary board commands on the current connection.
+        Servers without binary support reply with an error and text is used.
+        Returns True if binary board commands are used.
+        """
+
+        reply = self.send_command(
+            self.socketserver, f"Protocol Binary {BinaryProtocol.VERSION}"
+        )
+
+        self.protocol_binary = int(
+            reply is not None and len(reply) > 0 and reply[0] == "OK"
+        )
+        self.protocol_socket = self.socketserver.socket
+
+        protocol = "binary" if self.protocol_binary else "text"
+        azcam.log(f"camserver board commands use {protocol} protocol", level=3)
+
+        return bool(self.protocol_binary)
+
+    @staticmethod
+    def get_integer_args(*args):
+        """
+        Return board command arguments as integers, or None if any is not an integer.
+        """
+
+        try:
+            return [int(arg) for arg in args]
+        except (TypeError, ValueError):
+            return None
+
+    def board_command_binary(self, cmdnum, board, arg1, arg2, arg3, arg4):
+        """
+        Send a board command as a binary frame and return the reply as a list.
+        Arguments must be integers.
+        The connection lock is held so other threads' commands cannot interleave.
+        """
+
+        t0 = time.perf_counter()
+
+        with self.socketserver.lock:
+            sock = self.socketserver.socket
+            if sock is None:
+                raise azcam.AzcamError("Could not connect to camserver")
+
             try:
-                reply = self.socketserver.command(command, terminator)
-                return reply
-            except azcam.AzcamError as e:
-                if e.error_code == 2:
+                frame, sequence = self.binary.pack_request(
+                    cmdnum, board, arg1, arg2, arg3, arg4
+                )
+                sock.sendall(frame)
+                status, replyseq, value = BinaryProtocol.unpack_reply(
+                    self.recv_exact(sock, BinaryProtocol.REPLY.size)
+                )
+                if status == BinaryProtocol.ERROR:
+                    message = self.recv_exact(sock, value).decode()
+            except (OSError, ValueError, struct.error) as e:
+                self.socketserver.close()
+                raise azcam.AzcamError(f"Binary board command failed: {e}")
+
+            if replyseq != sequence:
+                self.socketserver.close()
+                raise azcam.AzcamError("Binary board command reply out of sequence")
+
+        if self.command_stats is not None:
+            self.command_stats.record(
+                f"BoardCommand {cmdnum}", time.perf_counter() - t0
+            )
+
+        if status == BinaryProtocol.ERROR:
+            return ["ERROR", message]
+
+        return ["OK", value]
+
+    @staticmethod
+    def recv_exact(sock, size):
+        """
+        Receive exactly size bytes from a socket.
+        """
+
+        data = bytearray(size)
+        view = memoryview(data)
+        count = 0
+        while count < size:
+            nbytes = sock.recv_into(view[count:])
+            if nbytes == 0:
+                raise ConnectionError("connection closed by camserver")
+            count += nbytes
+
+        return bytes(data)
+
+    def get_channel(self, command: str):
+        """
+        Return the channel name for a command, or None for the main connection.
+        """
+
+        if not self.use_channels:
+            return None
+
+        return self.channel_commands.get(command.strip())
+
+    def get_channel_socket(self, channel: str):
+        """
+        Return the connection for a channel, creating it if needed.
+        """
+
+        try:
+            return self.channels[channel]
+        except KeyError:
+            socketserver = azcam.sockets.SocketInterface(self.host, self.port)
+            self.channels[channel] = socketserver
+            return socketserver
+
+    def open_channels(self):
+        """
+        Open status and control connections if use_channels is set, so they are ready
+        before they are needed during an exposure.
+        """
+
+        if not self.use_channels or self.demo_mode:
+            return
+
+        for channel in set(self.channel_commands.values()):
+            with self.channel_locks.setdefault(channel, threading.Lock()):
+                socketserver = self.get_channel_socket(channel)
+                if not socketserver.connected and not socketserver.open():
+                    azcam.log(f"Could not open camserver {channel} channel", level=2)
+
+        return
+
+    def close_channels(self):
+        """
+        Close status and control connections, they are reopened when next used.
+        """
+
+        for channel, socketserver in list(self.channels.items()):
+            with self.channel_locks[channel]:
+                socketserver.close()
+        self.channels = {}
+
+        return
+
+    def command_batch(self, commands: list, terminator: str = "\n"):
+        """
+        Send several commands in one write and return their replies in order.
+        Replies are tokenized like command() replies.
+        A reply beginning with ERROR raises an AzcamError naming its command,
+        after all replies have been read.
+        Commands which send binary data, such as UploadFile, cannot be batched.
+        The connection lock is held for each write and its replies.
+        """
+
+        if self.demo_mode:
+            return [["DEMO", 0] for _ in commands]
+
+        replies = []
+        for first in range(0, len(commands), self.batch_size):
+            batch = commands[first : first + self.batch_size]
+
+            with self.socketserver.lock:
+                if not self.socketserver.open():
                     raise azcam.AzcamError("Could not connect to camserver")
 
+                t0 = time.perf_counter()
+                self.socketserver.send(terminator.join(batch), terminator)
+
+                # each recv returns one or more complete reply lines
+                lines = []
+                while len(lines) < len(batch):
+                    reply = self.socketserver.recv(-1, "\n")
+                    count = len(lines)
+                    lines.extend(line.rstrip("\r") for line in reply.split("\n"))
+
+                    # latency of each batched command is the time until its reply arrived
+                    if self.command_stats is not None:
+                        latency = time.perf_counter() - t0
+                        for command in batch[count : len(lines)]:
+                            self.command_stats.record(command, latency)
+
+            for line in lines:
+                try:
+                    replies.append(shlex.split(line))
+                except ValueError:
+                    replies.append(line.split())
+
+        for command, reply in zip(commands, replies):
+            if len(reply) > 0 and reply[0] == "ERROR":
+                message = " ".join(reply[1:]) or "Unknown error"
+                raise azcam.AzcamError(f"{command}: {message}")
+
+        return replies
+
+    def enable_command_stats(self, flag=True, ring_size=10000):
+        """
+        Enable or disable command latency statistics.
+        When disabled commands are not timed.
+        """
+
+        if flag:
+            if self.command_stats is None:
+                self.command_stats = CommandStats(ring_size)
+        else:
+            self.command_stats = None
+
+        return
+
+    def get_command_stats(self):
+        """
+        Return command latency statistics by verb, see CommandStats.get_stats().
+        """
+
+        if self.command_stats is None:
+            return {}
+
+        return self.command_stats.get_stats()
+
+    def begin_batch(self):
+        """
+        Start queuing commands sent with queue(), for example during a controller reset.
+        Calls may be nested, queued commands are sent by the outermost end_batch().
+        """
+
+        self.batch_depth += 1
+
+        return
+
+    def end_batch(self):
+        """
+        End a begin_batch() and send queued commands if it is the outermost one.
+        """
+
+        self.batch_depth = max(0, self.batch_depth - 1)
+        if self.batch_depth == 0:
+            self.flush_batch()
+
+        return
+
+    def queue(self, command: str):
+        """
+        Queue a command whose reply is not needed while batching, else send it now.
+        Returns None if the command was queued, else the reply.
+        """
+
+        if self.batch_depth == 0:
+            return self.command(command)
+
+        self.batch.append(command)
+        if len(self.batch) >= self.batch_size:
+            self.flush_batch()
+
+        return None
+
+    def flush_batch(self):
+        """
+        Send queued commands and check their replies.
+        """
+
+        commands = self.batch
+        self.batch = []
+
+        if commands:
+            try:
+                self.command_batch(commands)
+            except Exception:
+                # a queued Set may have failed after its value was cached
+                self.invalidate_cache()
+                raise
+
+        return
+
     def test(self):
         """
         Echo a message string from controller server.
@@ -107,13 +484,24 @@ class CameraServerInterface(object):
     def set(self, Parameter, value):
         """
         Set a parameter in the controller server.
+        Cached parameters are updated with the new value.
         """
 
-        return self.command("Set " + Parameter + " " + str(value))
+        reply = self.queue("Set " + Parameter + " " + str(value))
+
+        # reply is None when queued, an error is then raised when the batch is sent
+        queued = reply is None and self.batch_depth > 0
+        if queued or (reply is not None and len(reply) > 0 and reply[0] == "OK"):
+            self.set_cached(Parameter, ["OK", str(value)])
+        else:
+            self.invalidate_cache(Parameter)
+
+        return reply
 
     def get(self, Parameter):
         """
         Return a paramater from the controller server, as a string.
+        Parameters in cache_policy are returned from the cache while valid.
         """
 
         if self.demo_mode:
@@ -123,10 +511,59 @@ class CameraServerInterface(object):
             else:
                 reply = ["OK", 0]
         else:
-            reply = self.command("Get " + Parameter)
+            reply = self.get_cached(Parameter)
+            if reply is None:
+                reply = self.command("Get " + Parameter)
+                if reply is not None and len(reply) > 1 and reply[0] == "OK":
+                    self.set_cached(Parameter, reply)
 
         return reply
 
+    def get_cached(self, Parameter):
+        """
+        Return a copy of the cached reply for a parameter, or None if not cached
+        or expired.
+        """
+
+        if not self.use_cache:
+            return None
+
+        try:
+            reply, cachetime = self.cache[Parameter]
+        except KeyError:
+            return None
+
+        ttl = self.cache_policy.get(Parameter)
+        if ttl is None or (ttl > 0 and time.monotonic() - cachetime > ttl):
+            self.cache.pop(Parameter, None)
+            return None
+
+        return list(reply)
+
+    def set_cached(self, Parameter, reply):
+        """
+        Cache a reply for a parameter if its cache_policy allows it.
+        """
+
+        if not self.use_cache or Parameter not in self.cache_policy:
+            return
+
+        self.cache[Parameter] = (list(reply), time.monotonic())
+
+        return
+
+    def invalidate_cache(self, Parameter=None):
+        """
+        Remove a parameter from the cache, or all parameters if None.
+        """
+
+        if Parameter is None:
+            self.cache = {}
+        else:
+            self.cache.pop(Parameter, None)
+
+        return
+
     def close_server(self):
         """
         Closes the ControllerServer.
@@ -140,8 +577,10 @@ class CameraServerInterface(object):
         """
 
         self.command("RestartServer")
+        self.invalidate_cache()
         if not self.demo_mode:
             self.socketserver.close()  # close socket as it is reset in CS
+            self.close_channels()
 
         return
 
@@ -151,8 +590,10 @@ class CameraServerInterface(object):
         """
 
         self.command("ResetServer")
+        self.invalidate_cache()
         if not self.demo_mode:
             self.socketserver.close()  # close socket as it is reset in CS
+            self.close_channels()
 
         return
 
@@ -0,0 +1,472 @@
+"""
+Contains the CameraServerSimulator class, a local stand-in for an ARC camera server.
+
+Implements the text command protocol used by CameraServerInterface, the optional
+binary board command framing of BinaryProtocol and the binary GetImageData and
+ResumeImageData protocol used by ReceiveData, so the socket and deinterlace code can
+be exercised without controller hardware. Run as a script to start a simulator:
+
+    python -m azcam_arc.camserver_sim --port 2405 --pixel-rate 1e6
+"""
+
+import argparse
+import random
+import shlex
+import socketserver
+import threading
+import time
+
+import numpy
+
+from .binary_protocol import BinaryProtocol
+from .pixel_format import PixelFormat
+
+
+class CameraServerSimulator(object):
+    """
+    Simulated ARC camera server.
+    """
+
+    # DSP reply code for done
+    DON = 0x00444F4E
+
+    def __init__(self, host="localhost", port=0):
+
+        self.host = host
+        self.port = port
+
+        # simulated readout rate, pixels/second, 0 for all data ready immediately
+        self.pixel_rate = 0.0
+        # maximum bytes returned by one GetImageData request, 0 for no limit
+        self.max_chunk = 0
+        # delay before each GetImageData reply, seconds
+        self.latency = 0.0
+        # random extra delay up to this value before each GetImageData reply, seconds
+        self.jitter = 0.0
+        # delay before each command reply, seconds
+        self.command_latency = 0.0
+        # True to accept the binary board command protocol, False to act as an older server
+        self.binary_protocol = 1
+        # controller type returned by Get ControllerType
+        self.controller_type = 1
+        # True to accept ResumeImageData, False to act as an older server
+        self.resume_protocol = 1
+        # close the data connection once after sending this many bytes, 0 for never
+        self.disconnect_at = 0
+        # wire format of image data
+        self.pixel_format = PixelFormat()
+
+        # parameters from Set commands
+        self.parameters = {"NumberPixelsImage": 0, "ExposureTime": 0}
+        # DSP memory from WRM, keyed on (board, address)
+        self.memory = {}
+        # uploaded files, keyed on filename
+        self.files = {}
+        # log of received commands
+        self.commands = []
+
+        # image data sent for each readout, pixel values
+        self.image_data = None
+        # image data in wire format, uint8
+        self.wire_data = None
+        # bytes of image data sent for current readout
+        self.data_sent = 0
+        # time.perf_counter() when readout started, 0 if no readout
+        self.readout_start = 0.0
+        # pixels read when readout was aborted, -1 if not aborted
+        self.readout_aborted = -1
+
+        # exposure timing
+        self.exposure_start = 0.0
+        self.paused_time = 0.0
+        self.pause_start = 0.0
+
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Start the simulator on a background thread.
+        Returns the port number, which is assigned by the system if port is 0.
+        """
+
+        self.server = socketserver.ThreadingTCPServer(
+            (self.host, self.port), _SimulatorHandler, bind_and_activate=False
+        )
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.simulator = self
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="camserversim", daemon=True
+        )
+        self.thread.start()
+
+        return self.port
+
+    def stop(self):
+        """
+        Stop the simulator.
+        """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+        return
+
+    def make_image_data(self, numpix):
+        """
+        Return the pixel data sent for a readout of numpix pixels.
+        If image_data is not set a repeating ramp is used, so each pixel value is
+        its position in the data stream modulo 2**bits of pixel_format (at most 2**20).
+        """
+
+        if self.image_data is None or self.image_data.size != numpix:
+            period = 1 << min(self.pixel_format.bits, 20)
+            dtype = "<u2" if self.pixel_format.bits == 16 else "<u4"
+            self.image_data = numpy.resize(numpy.arange(period, dtype=dtype), numpix)
+
+        self.wire_data = self.pixel_format.pack(self.image_data)
+
+        return self.image_data
+
+    def pixels_read(self):
+        """
+        Return number of pixels read out by the simulated controller.
+        """
+
+        if self.readout_start == 0:
+            return 0
+
+        numpix = int(self.parameters["NumberPixelsImage"])
+
+        if self.readout_aborted >= 0:
+            return self.readout_aborted
+
+        if self.pixel_rate <= 0:
+            return numpix
+
+        return min(
+            numpix, int((time.perf_counter() - self.readout_start) * self.pixel_rate)
+        )
+
+    # **********************************************************************************************
+    # commands
+    # **********************************************************************************************
+
+    def command(self, tokens):
+        """
+        Execute a text command and return the reply string.
+        """
+
+        self.commands.append(" ".join(tokens))
+
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+
+        cmd = tokens[0].lower()
+        args = tokens[1:]
+
+        if cmd == "cmd" and len(args) > 0:  # cmd UploadFile, cmd DeleteFile
+            cmd = args[0].lower()
+            args = args[1:]
+
+        try:
+            method = getattr(self, f"cmd_{cmd}")
+        except AttributeError:
+            return f"ERROR Unknown command {tokens[0]}"
+
+        try:
+            return method(*args)
+        except (TypeError, ValueError, KeyError) as e:
+            return f"ERROR {tokens[0]}: {e}"
+
+    def cmd_echo(self, *args):
+        return "OK " + " ".join(args)
+
+    def cmd_get(self, parameter):
+
+        if parameter == "ControllerType":
+            return f"OK {self.controller_type}"
+        elif parameter == "PixelCount":
+            return f"OK {self.pixels_read()}"
+        elif parameter == "ExposureTimeRemaining":  # actually elapsed time
+            if self.exposure_start == 0:
+                return "OK 0"
+            paused = self.paused_time
+            if self.pause_start > 0:
+                paused += time.perf_counter() - self.pause_start
+            elapsed = time.perf_counter() - self.exposure_start - paused
+            return f"OK {int(elapsed * 1000)}"
+        else:
+            return f"OK {self.parameters[parameter]}"
+
+    def cmd_set(self, parameter, value):
+        self.parameters[parameter] = value
+        return "OK"
+
+    def cmd_loadfile(self, board, filename):
+        if filename not in self.files:
+            return f"ERROR File not found: {filename}"
+        return "OK"
+
+    def cmd_deletefile(self, filename):
+        self.files.pop(filename, None)
+        return "OK"
+
+    def cmd_resetcontroller(self):
+        self.memory = {}
+        return "OK"
+
+    def cmd_closeserver(self):
+        return "OK"
+
+    def cmd_restartserver(self):
+        return "OK"
+
+    def cmd_resetserver(self):
+        return "OK"
+
+    def cmd_ioctl(self, *args):
+        return "OK"
+
+    def cmd_protocol(self, name, version):
+        if not self.binary_protocol or name.lower() != "binary":
+            return f"ERROR Unknown protocol {name}"
+        if int(version) != BinaryProtocol.VERSION:
+            return f"ERROR Unsupported protocol version {version}"
+        return f"OK Binary {BinaryProtocol.VERSION}"
+
+    def cmd_boardcommand(
+        self, cmdnum, board, arg1="-1", arg2="-1", arg3="-1", arg4="-1"
+    ):
+
+        # arguments may be words, such as the VID or CLK Type of SBN
+        args = [int(arg) if arg.lstrip("-").isdigit() else arg for arg in [arg1, arg2]]
+
+        cmdnum = int(cmdnum)
+        value = self.board_command(cmdnum, int(board), *args)
+
+        if value == self.DON:
+            return f"OK 0x{self.DON:08X}"
+
+        return f"OK {value}"
+
+    def board_command(self, cmdnum, board, arg1=-1, arg2=-1):
+        """
+        Execute a board command and return the reply value.
+        """
+
+        name = "".join(chr((cmdnum >> shift) & 0xFF) for shift in [16, 8, 0])
+
+        if name == "WRM":
+            self.memory[(board, arg1)] = arg2
+        elif name == "RDM":
+            return self.memory.get((board, arg1), 0)
+        elif name == "TDL":
+            return arg1
+
+        return self.DON
+
+    def binary_command(self, frame):
+        """
+        Execute a binary board command request frame and return the reply frame.
+        """
+
+        reqtype, sequence, cmdnum, board, *args = BinaryProtocol.unpack_request(frame)
+
+        self.commands.append(
+            f"BoardCommand {cmdnum} {board} " + " ".join(map(str, args))
+        )
+
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+
+        if reqtype != BinaryProtocol.BOARD_COMMAND:
+            return BinaryProtocol.pack_reply(
+                sequence, message=f"Unknown request type {reqtype}"
+            )
+
+        value = self.board_command(cmdnum, board, args[0], args[1])
+
+        return BinaryProtocol.pack_reply(sequence, value & 0xFFFFFFFF)
+
+    def cmd_startexposure(self):
+        self.exposure_start = time.perf_counter()
+        self.paused_time = 0.0
+        self.pause_start = 0.0
+        return "OK"
+
+    def cmd_abortexposure(self):
+        self.exposure_start = 0.0
+        return "OK"
+
+    def cmd_pauseexposure(self):
+        self.pause_start = time.perf_counter()
+        return "OK"
+
+    def cmd_resumeexposure(self):
+        if self.pause_start > 0:
+            self.paused_time += time.perf_counter() - self.pause_start
+        self.pause_start = 0.0
+        return "OK"
+
+    def cmd_readimage(self):
+        with self.lock:
+            self.make_image_data(int(self.parameters["NumberPixelsImage"]))
+            self.data_sent = 0
+            self.readout_aborted = -1
+            self.readout_start = time.perf_counter()
+        return "OK"
+
+    def cmd_abortreadout(self):
+        with self.lock:
+            self.readout_aborted = self.pixels_read()
+        return "OK"
+
+    def resume_image_data(self, offset):
+        """
+        Continue image data from byte offset and return the confirmation frame header.
+        """
+
+        with self.lock:
+            self.data_sent = int(offset)
+
+        return b"%16d " % self.data_sent
+
+    def get_image_frame(self, datacnt):
+        """
+        Return the next GetImageData frame for a request of datacnt bytes,
+        as a (header, data, disconnect) tuple.
+        disconnect is True if the connection should be closed after sending data,
+        which is then short of the size in header.
+        """
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self.lock:
+            available = (
+                min(
+                    self.wire_data.size, self.pixel_format.get_bytes(self.pixels_read())
+                )
+                - self.data_sent
+            )
+            size = max(0, min(int(datacnt), available))
+            if self.max_chunk > 0:
+                size = min(size, self.max_chunk)
+
+            start = self.data_sent
+            self.data_sent += size
+
+            end = start + size
+            disconnect = start < self.disconnect_at < end
+            if disconnect:
+                end = self.disconnect_at
+                self.disconnect_at = 0
+
+        header = b"%16d " % size
+        if size == 0:
+            return header, b"", False
+
+        data = memoryview(self.wire_data)[start:end]
+
+        return header, data, disconnect
+
+
+class _SimulatorHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection to the simulator.
+    """
+
+    def handle(self):
+
+        sim = self.server.simulator
+
+        while True:
+            try:
+                first = self.rfile.peek(1)[:1]
+                if first == bytes([BinaryProtocol.MAGIC]):
+                    frame = self.rfile.read(BinaryProtocol.REQUEST.size)
+                    if len(frame) < BinaryProtocol.REQUEST.size:
+                        return
+                    self.wfile.write(sim.binary_command(frame))
+                    continue
+                line = self.rfile.readline()
+            except OSError:
+                return
+            if not line:
+                return
+
+            line = line.decode().strip()
+            if not line:
+                continue
+
+            try:
+                tokens = shlex.split(line)
+            except ValueError:
+                tokens = line.split()
+
+            if tokens[0] == "GetImageData":
+                header, data, disconnect = sim.get_image_frame(tokens[1])
+                self.wfile.write(header)
+                if len(data) > 0:
+                    self.wfile.write(data)
+                if disconnect:
+                    return
+                continue
+
+            if tokens[0] == "ResumeImageData" and sim.resume_protocol:
+                self.wfile.write(sim.resume_image_data(tokens[1]))
+                continue
+
+            if len(tokens) > 2 and tokens[1] == "UploadFile":
+                size = int(tokens[2])
+                self.wfile.write(b"OK\n")
+                fbuffer = self.rfile.read(size)
+                filename = f"/tmp/azcamsim{len(sim.files)}.lod"
+                sim.files[filename] = fbuffer
+                self.wfile.write(f"OK {filename}\n".encode())
+                continue
+
+            reply = sim.command(tokens)
+            self.wfile.write((reply + "\n").encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated ARC camera server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=2405)
+    parser.add_argument("--pixel-rate", type=float, default=0.0, help="pixels/second")
+    parser.add_argument("--max-chunk", type=int, default=0, help="bytes per data frame")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument(
+        "--text-only", action="store_true", help="refuse binary board commands"
+    )
+    args = parser.parse_args()
+
+    sim = CameraServerSimulator(args.host, args.port)
+    sim.pixel_rate = args.pixel_rate
+    sim.max_chunk = args.max_chunk
+    sim.latency = args.latency
+    sim.jitter = args.jitter
+    sim.binary_protocol = 0 if args.text_only else 1
+
+    port = sim.start()
+    print(f"ARC camera server simulator running on {args.host}:{port}")
+    try:
+        sim.thread.join()
+    except KeyboardInterrupt:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
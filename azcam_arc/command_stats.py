@@ -0,0 +1,183 @@
+"""
+Contains the CommandStats class.
+"""
+
+import bisect
+import collections
+import json
+import threading
+import time
+
+
+class CommandStats(object):
+    """
+    Counts and latency histograms of controller server commands, per command verb.
+    Verbs are the command name plus its first argument where that identifies the
+    operation, for example "BoardCommand WRM", "Get PixelCount" or "ReadImage".
+    Recent commands are also kept in a ring buffer.
+    """
+
+    def __init__(self, ring_size=10000):
+
+        # histogram bin upper edges, seconds, doubling from 16 usec to about 17 sec
+        self.bin_edges = [16.0e-6 * 2**n for n in range(21)]
+
+        # per-verb statistics, see get_stats()
+        self.verbs = {}
+        # recent commands as (time, verb, latency) tuples
+        self.ring = collections.deque(maxlen=ring_size)
+
+        # time statistics were started or reset, seconds since epoch
+        self.start_time = time.time()
+
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        Clear all statistics.
+        """
+
+        with self.lock:
+            self.verbs = {}
+            self.ring.clear()
+            self.start_time = time.time()
+
+        return
+
+    @staticmethod
+    def get_verb(command):
+        """
+        Return the verb of a command string.
+        """
+
+        tokens = command.split()
+        if len(tokens) == 0:
+            return ""
+
+        name = tokens[0]
+        if len(tokens) == 1:
+            return name
+
+        if name == "BoardCommand":
+            # 3 character DSP command packed in an integer
+            try:
+                cmdnum = int(tokens[1])
+                return (
+                    name + " " + "".join(chr((cmdnum >> s) & 0xFF) for s in [16, 8, 0])
+                )
+            except ValueError:
+                return name
+        elif name.lower() in ["get", "set", "cmd"]:
+            return name + " " + tokens[1]
+
+        return name
+
+    def record(self, command, latency):
+        """
+        Record a command and its reply latency in seconds.
+        """
+
+        verb = self.get_verb(command)
+        index = bisect.bisect_left(self.bin_edges, latency)
+
+        with self.lock:
+            try:
+                stats = self.verbs[verb]
+            except KeyError:
+                stats = {
+                    "count": 0,
+                    "total": 0.0,
+                    "min": latency,
+                    "max": latency,
+                    "histogram": [0] * (len(self.bin_edges) + 1),
+                }
+                self.verbs[verb] = stats
+
+            stats["count"] += 1
+            stats["total"] += latency
+            stats["min"] = min(stats["min"], latency)
+            stats["max"] = max(stats["max"], latency)
+            stats["histogram"][index] += 1
+
+            self.ring.append((time.time(), verb, latency))
+
+        return
+
+    def get_percentile(self, histogram, fraction):
+        """
+        Return the histogram bin upper edge below which fraction of the commands fall.
+        """
+
+        target = fraction * sum(histogram)
+        count = 0
+        for index, value in enumerate(histogram):
+            count += value
+            if count >= target and count > 0:
+                if index < len(self.bin_edges):
+                    return self.bin_edges[index]
+                return float("inf")
+
+        return 0.0
+
+    def get_stats(self):
+        """
+        Return a dictionary of statistics for each verb, with count, mean, min, max,
+        p50 and p95 latencies (bin upper edges) in seconds and the histogram counts.
+        """
+
+        with self.lock:
+            verbs = {verb: dict(stats) for verb, stats in self.verbs.items()}
+
+        for stats in verbs.values():
+            stats["mean"] = stats["total"] / stats["count"]
+            stats["p50"] = self.get_percentile(stats["histogram"], 0.50)
+            stats["p95"] = self.get_percentile(stats["histogram"], 0.95)
+            stats["histogram"] = list(stats["histogram"])
+
+        return verbs
+
+    def get_samples(self):
+        """
+        Return recent commands from the ring buffer as a list of (time, verb, latency).
+        """
+
+        with self.lock:
+            return list(self.ring)
+
+    def dump(self, filename, samples=False):
+        """
+        Append statistics to filename as one line of JSON.
+        samples True also writes the ring buffer.
+        """
+
+        data = {
+            "start_time": self.start_time,
+            "time": time.time(),
+            "bin_edges": self.bin_edges,
+            "verbs": self.get_stats(),
+        }
+        if samples:
+            data["samples"] = self.get_samples()
+
+        with open(filename, "a") as f:
+            f.write(json.dumps(data) + "\n")
+
+        return
+
+    def report(self):
+        """
+        Return statistics as a text table sorted by total time.
+        """
+
+        lines = [
+            f"{'verb':24s} {'count':>8s} {'mean ms':>9s} {'p95 ms':>9s} {'max ms':>9s} {'total s':>9s}"
+        ]
+        stats = self.get_stats()
+        for verb in sorted(stats, key=lambda v: -stats[v]["total"]):
+            s = stats[verb]
+            lines.append(
+                f"{verb:24s} {s['count']:8d} {s['mean'] * 1e3:9.3f} "
+                f"{s['p95'] * 1e3:9.3f} {s['max'] * 1e3:9.3f} {s['total']:9.3f}"
+            )
+
+        return "\n".join(lines)
@@ -71,6 +71,9 @@ class ControllerArc(Controller):
         self.RDA = 0x00524441
         self.IIA = 0x00494941
 
+        # board commands which reply with data, never queued while batching
+        self.data_commands = ["RDM", "TDL"]
+
         # DSP memory locations
         self.Y_CAMSTAT = 0x0  # not used GEN1
         self.Y_NSDATA = 0x1
@@ -239,15 +242,27 @@ class ControllerArc(Controller):
         # once code is loaded, controller is "reset"
         self.is_reset = 1
 
-        self.set_bias_voltages()
-        self.set_shutter(0)
+        # send setup commands in a few writes, replies are checked by end_batch()
+        # biases must be set without error before power is applied
+        self.camserver.begin_batch()
+        try:
+            self.set_bias_voltages()
+            self.set_shutter(0)
+        finally:
+            self.camserver.end_batch()
+
         self.power_on()
-        self.start_idle()
-        self.set_video_gain(self.video_gain)
-        self.set_video_speed(self.video_speed)
-        self.select_video_outputs()
-        self.set_roi()
-        self.set_exposuretime(0)  # new was .exposure_time
+
+        self.camserver.begin_batch()
+        try:
+            self.start_idle()
+            self.set_video_gain(self.video_gain)
+            self.set_video_speed(self.video_speed)
+            self.select_video_outputs()
+            self.set_roi()
+            self.set_exposuretime(0)  # new was .exposure_time
+        finally:
+            self.camserver.end_batch()
 
         return
 
@@ -261,11 +276,14 @@ class ControllerArc(Controller):
 
         # send parameters to controller in order to do all hardware communication here
         if self.is_reset:
-            self._write_controller_roi()
+            self.camserver.begin_batch()
+            try:
+                self._write_controller_roi()
 
-        # update ControllerServer for image size
-        if self.is_reset:
-            self.camserver.set("NumberPixelsImage", self.detpars.numpix_image)
+                # update ControllerServer for image size
+                self.camserver.set("NumberPixelsImage", self.detpars.numpix_image)
+            finally:
+                self.camserver.end_batch()
 
         return
 
@@ -527,19 +545,15 @@ class ControllerArc(Controller):
         # change 3 char ascii string to integer
         cmdnum = (ord(Command[0]) << 16) + (ord(Command[1]) << 8) + (ord(Command[2]))
 
-        reply = self.camserver.command(
-            "BoardCommand "
-            + str(cmdnum)
-            + " "
-            + str(BoardNumber)
-            + " "
-            + str(Arg1)
-            + " "
-            + str(Arg2)
-            + " "
-            + str(Arg3)
-            + " "
-            + str(Arg4)
+        # while batching, commands which return status only are sent later
+        if self.camserver.batch_depth and Command not in self.data_commands:
+            self.camserver.queue(
+                f"BoardCommand {cmdnum} {BoardNumber} {Arg1} {Arg2} {Arg3} {Arg4}"
+            )
+            return "DON"
+
+        reply = self.camserver.board_command(
+            cmdnum, BoardNumber, Arg1, Arg2, Arg3, Arg4
         )
 
         # check for ERROR
@@ -550,16 +564,18 @@ class ControllerArc(Controller):
         if reply[0] == "DEMO":
             return reply[1]
 
-        # convert controller DSP codes
-        try:
-            rep = reply[1]
-            if rep.startswith("0x"):
-                rep = rep.lstrip("0x")
-                irep = int(rep, 16)
-            else:
-                irep = int(rep, 10)
-        except Exception:
-            return reply[1]
+        # convert controller DSP codes, binary protocol replies are already integers
+        rep = reply[1]
+        if isinstance(rep, int):
+            irep = rep
+        else:
+            try:
+                if rep.startswith("0x"):
+                    irep = int(rep, 16)
+                else:
+                    irep = int(rep, 10)
+            except Exception:
+                return reply[1]
 
         if irep == self.DON:
             reply1 = "DON"
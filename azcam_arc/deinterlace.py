@@ -0,0 +1,83 @@
+"""
+Contains the Deinterlacer class.
+"""
+
+import numpy
+
+import azcam
+
+
+class Deinterlacer(object):
+    """
+    Deinterlaces image data received from the controller server into amplifier order.
+    Amplifier index maps are computed once per focalplane geometry and data order,
+    then cached and reused for every readout.
+    """
+
+    def __init__(self):
+
+        # cached amplifier index maps, keyed on (numamps, numpix_amp, data_order)
+        self.index_maps = {}
+
+        # number of pixels deinterlaced per vectorized block, sized to stay in CPU cache
+        self.block_size = 65536
+
+    def get_index_map(self, numamps, numpix_amp, data_order=[]):
+        """
+        Return the amplifier index map for a geometry.
+        Entry i of the map is the amplifier position in the received data stream
+        which is placed in row i of the image data.
+        """
+
+        key = (numamps, numpix_amp, tuple(data_order))
+
+        try:
+            return self.index_maps[key]
+        except KeyError:
+            pass
+
+        if len(data_order) == 0:
+            index_map = numpy.arange(numamps, dtype=numpy.intp)
+        else:
+            index_map = numpy.array(data_order, dtype=numpy.intp)
+            if index_map.min() < 0 or index_map.max() >= numamps:
+                raise azcam.AzcamError(
+                    f"Invalid data_order for {numamps} amplifiers: {data_order}"
+                )
+
+        # geometry changes (ROI, binning) make old maps useless
+        self.index_maps = {key: index_map}
+
+        return index_map
+
+    def deinterlace(self, buffer, data, numamps, numpix_amp, data_order=[], start=0):
+        """
+        Deinterlace buffer into data in a single vectorized pass over cache-sized blocks.
+        buffer is the received pixel data, one pixel from each amplifier in turn.
+        data is the image data array, shape [amplifiers, numpix_amp].
+        start is the pixel position in each amplifier of the first pixel group in buffer,
+        so an image may be deinterlaced in blocks as data arrives.
+        """
+
+        index_map = self.get_index_map(numamps, numpix_amp, data_order)
+
+        numgroups = buffer.size // numamps
+        blockgroups = max(1, self.block_size // numamps)
+        out = data[: len(index_map)]
+
+        for group in range(0, numgroups, blockgroups):
+            lastgroup = min(group + blockgroups, numgroups)
+
+            # [numamps, groups] strided view of buffer, no copy
+            block = buffer[group * numamps : lastgroup * numamps]
+            block = block.reshape(lastgroup - group, numamps).T
+
+            numpy.take(
+                block,
+                index_map,
+                axis=0,
+                out=out[:, start + group : start + lastgroup],
+                mode="clip",
+            )
+
+        return
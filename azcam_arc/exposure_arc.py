@@ -2,14 +2,20 @@
 Contains the ExposureArc class.
 """
 
+import asyncio
+import concurrent.futures
+import copy
 import os
 import threading
 import time
 
+import numpy
+
 import azcam
 from azcam.exposure import Exposure
 
-from .receive_data import ReceiveData
+from .receive_data import ReceiveData, run_coroutine
+from .shared_image import SharedImage
 
 
 class ExposureArc(Exposure):
@@ -23,6 +29,33 @@ class ExposureArc(Exposure):
 
         self.receive_data = ReceiveData(self)
 
+        # True to receive and write images on a background thread
+        self.receive_async = 0
+        # alternate image buffer used while the last image is received and written
+        self.image_alternate = None
+        # background threads for the last image
+        self.receive_thread = None
+        self.write_thread = None
+        # error raised by the background receive, raised again by wait_receive_async()
+        self.receive_error = None
+        # event set to abort the background receive of the image being read out
+        self.receive_abort = None
+
+        # camera servers of all controllers of a mosaic camera, empty for one controller
+        self.mosaic_camservers = []
+        # number of image amplifiers read by each mosaic camera server, [] for equal split
+        self.mosaic_numamps = []
+        # ReceiveData object for each mosaic camera server
+        self.mosaic_receivers = []
+
+        # per-amplifier statistics of last received image, see get_amp_statistics()
+        self.amp_statistics = {}
+        # True to write amplifier statistics as header keywords
+        self.amp_statistics_keywords = 0
+
+        # image data published in shared memory, set shared_image.enabled to use
+        self.shared_image = SharedImage()
+
     def integrate(self):
         """
         Integration.
@@ -46,7 +79,27 @@ class ExposureArc(Exposure):
         # start exposure
         if imagetype != "zero":
             azcam.log("Integration started")
-        azcam.db.controller.start_exposure()
+
+        # open status and control connections now so they are not part of the exposure
+        azcam.db.controller.camserver.open_channels()
+        for camserver in self.mosaic_camservers:
+            camserver.open_channels()
+
+        # connect image data socket now so it is not part of readout or dark time
+        if not azcam.db.controller.camserver.demo_mode:
+            try:
+                if self.mosaic_camservers:
+                    for receiver in self.get_mosaic_receivers():
+                        receiver.connect()
+                else:
+                    self.receive_data.connect()
+            except (OSError, asyncio.TimeoutError) as e:
+                azcam.log(f"Could not connect image data socket: {e}", level=2)
+
+        if self.mosaic_camservers:
+            self.start_exposure_mosaic()
+        else:
+            azcam.db.controller.start_exposure()
 
         """
         # do this for any return below
@@ -77,7 +130,7 @@ class ExposureArc(Exposure):
             if loopcount > 20:
                 azcam.log("ERROR Integration time stuck")
                 self.exposure_flag = self.exposureflags["ABORT"]
-                azcam.db.controller.exposure_abort()
+                self.command_mosaic("AbortExposure", azcam.db.controller.exposure_abort)
                 break
             elif (
                 self.exposure_flag == self.exposureflags["ABORT"]
@@ -88,18 +141,22 @@ class ExposureArc(Exposure):
                     self.exposure_sequence_number = 1
                     self.exposure_flag = self.exposureflags["EXPOSING"]
                 else:
-                    azcam.db.controller.exposure_abort()
+                    self.command_mosaic(
+                        "AbortExposure", azcam.db.controller.exposure_abort
+                    )
                     break
             elif (
                 self.exposure_flag == self.exposureflags["PAUSE"]
             ):  # PauseExposure received
-                azcam.db.controller.exposure_pause()
+                self.command_mosaic("PauseExposure", azcam.db.controller.exposure_pause)
                 self.exposure_flag = self.exposureflags["PAUSED"]
                 azcam.log("Integration paused")
             elif (
                 self.exposure_flag == self.exposureflags["RESUME"]
             ):  # ResumeExposure received
-                azcam.db.controller.exposure_resume()
+                self.command_mosaic(
+                    "ResumeExposure", azcam.db.controller.exposure_resume
+                )
                 self.exposure_flag = self.exposureflags["EXPOSING"]
                 reply = self.get_exposuretime_remaining()
                 remtime = reply
@@ -157,6 +214,12 @@ class ExposureArc(Exposure):
         Exposure readout.
         """
 
+        # both replace image.data, the shared memory view would be lost
+        if self.shared_image.enabled and self.receive_data.memmap_folder:
+            raise azcam.AzcamError(
+                "shared_image cannot be used with receive_data.memmap_folder"
+            )
+
         self.exposure_flag = self.exposureflags["READ"]
 
         imagetype = self.image_type.lower()
@@ -167,25 +230,71 @@ class ExposureArc(Exposure):
         if self.tdi_mode:
             self.set_tdi_delay(True)
 
+        # previous image must be received before the controller server reads again
+        self.wait_receive_async()
+
+        # a background receive is aborted only by an abort of its own readout
+        if self.receive_async:
+            self.receive_abort = threading.Event()
+        else:
+            self.receive_abort = None
+        self.receive_data.abort_event = self.receive_abort
+
+        # receive directly into shared memory so other processes see the readout
+        self.receive_data.prepare_image(self.image)
+        if self.shared_image.enabled:
+            self.shared_image.publish(self.image, self.get_filename())
+
         # start readout
-        azcam.db.controller.start_readout()
+        if self.mosaic_camservers:
+            self.start_readout_mosaic()
+        else:
+            self.receive_data.readout_start_time = time.perf_counter()
+            azcam.db.controller.start_readout()
         self.exposure_flag = self.exposureflags["READOUT"]
         azcam.log("Readout started")
 
-        # start data transfer, returns when all data is received
-        try:
-            self.receive_data.receive_image_data(self.image.focalplane.numpix_image * 2)
-        except azcam.AzcamError as e:
-            if e.error_code == 3:
-                azcam.log("Exposure aborted")
-            else:
-                raise
+        if self.receive_async:
+            # start data transfer in background, returns when detector readout is done
+            self.receive_thread = threading.Thread(
+                target=self.receive_image_async,
+                name="receiveasync",
+                args=[self.image],
+            )
+            self.receive_thread.start()
+            self.wait_readout()
+            if (
+                self.exposure_flag == self.exposureflags["ABORT"]
+                and not self.is_exposure_sequence
+            ):
+                self.receive_abort.set()
+        else:
+            # start data transfer, returns when all data is received
+            try:
+                if self.mosaic_camservers:
+                    self.receive_image_mosaic(self.image)
+                else:
+                    self.receive_data.receive_image_data(
+                        self.receive_data.get_data_size(
+                            self.image.focalplane.numpix_image
+                        )
+                    )
+            except azcam.AzcamError as e:
+                if e.error_code == 3:
+                    azcam.log("Exposure aborted")
+                    self.set_shared_image_state("aborted")
+                else:
+                    self.set_shared_image_state("aborted")
+                    raise
+            self.amp_statistics = self.get_amp_statistics()
+            self.set_shared_image_state("complete")
 
         # check if aborted by user
         if azcam.db.abortflag and self.is_exposure_sequence:  # stop exposure sequence
             azcam.log("User abort in exposure sequence")
 
-        self.image.valid = 1
+        if not self.receive_async:
+            self.image.valid = 1
 
         if imagetype == "ramp":
             azcam.db.controller.set_shutter(0)
@@ -235,6 +344,10 @@ class ExposureArc(Exposure):
             LocalFile = self.get_filename()
         self.last_filename = LocalFile
 
+        if self.receive_async:
+            self.end_async(LocalFile)
+            return
+
         # wait for image data to be received
         loop = 0
         while not self.image.valid and loop < 100:
@@ -252,6 +365,8 @@ class ExposureArc(Exposure):
         azcam.db.headers["exposure"].set_keyword(
             "DARKTIME", dt, "Dark time (seconds)", float
         )
+        if self.amp_statistics_keywords:
+            self.set_amp_statistics_keywords()
 
         # write file(s) to disk
         if self.save_file:
@@ -313,6 +428,505 @@ class ExposureArc(Exposure):
 
         return
 
+    # **********************************************************************************************
+    # background receive and write
+    # **********************************************************************************************
+
+    def receive_image_async(self, image):
+        """
+        Receive image data into image, run on a background thread.
+        Errors other than an abort are kept in receive_error and the image is not written.
+        """
+
+        try:
+            if self.mosaic_camservers:
+                self.receive_image_mosaic(image)
+            else:
+                self.receive_data.receive_image_data(
+                    self.receive_data.get_data_size(image.focalplane.numpix_image),
+                    image,
+                )
+        except azcam.AzcamError as e:
+            self.set_shared_image_state("aborted")
+            if e.error_code != 3:
+                azcam.log(f"ERROR receiving image data: {e}")
+                self.receive_error = e
+                return
+            azcam.log("Exposure aborted")
+        except Exception as e:
+            self.set_shared_image_state("aborted")
+            azcam.log(f"ERROR receiving image data: {e}")
+            self.receive_error = e
+            return
+
+        self.amp_statistics = self.get_amp_statistics()
+        self.set_shared_image_state("complete")
+
+        image.valid = 1
+
+        return
+
+    def wait_readout(self):
+        """
+        Wait for the controller to finish reading the detector.
+        Image data may still be in transfer to this computer.
+        """
+
+        # there is no readout to wait for in demo mode
+        if azcam.db.controller.camserver.demo_mode:
+            return
+
+        lastcount = -1
+        loopcount = 0
+
+        while self.exposure_flag != self.exposureflags["ABORT"]:
+            if self.mosaic_camservers:
+                remaining = self.get_pixels_remaining_mosaic()
+            else:
+                remaining = azcam.db.controller.get_pixels_remaining()
+            if remaining == 0:
+                break
+
+            if remaining == lastcount:
+                loopcount += 1
+            else:
+                loopcount = 0
+                lastcount = remaining
+
+            if loopcount > 100:
+                azcam.log("ERROR Readout stuck")
+                break
+
+            azcam.log(f"Readout: {remaining:10d} pixels remaining", level=3)
+            time.sleep(0.1)
+
+        return
+
+    def end_async(self, LocalFile):
+        """
+        Completes an exposure by writing file and displaying image on a background thread.
+        The image buffers are swapped so the next exposure can start immediately.
+        """
+
+        # a receive which has already failed is reported now rather than written
+        if self.receive_thread is not None and not self.receive_thread.is_alive():
+            self.check_receive_error()
+
+        # update controller header with keywords which might have changed
+        et = float(int(self.exposure_time_actual * 1000.0) / 1000.0)
+        dt = float(int(self.dark_time * 1000.0) / 1000.0)
+        azcam.db.headers["exposure"].set_keyword(
+            "EXPTIME", et, "Exposure time (seconds)", float
+        )
+        azcam.db.headers["exposure"].set_keyword(
+            "DARKTIME", dt, "Dark time (seconds)", float
+        )
+
+        # the next exposure refills the shared header objects and may change the
+        # geometry while this image is written
+        focalplane = self.image.focalplane
+        exposure_header = self.copy_image_header(self.image)
+        self.image.focalplane = copy.deepcopy(focalplane)
+
+        self.write_thread = threading.Thread(
+            target=self.write_image_async,
+            name="writeimageasync",
+            args=[self.image, LocalFile, self.receive_thread, exposure_header],
+        )
+        self.write_thread.start()
+
+        self.swap_image_buffers(focalplane)
+
+        # reset idle if no flush
+        if not self.flush_array:
+            azcam.db.controller.start_idle()
+
+        # increment file sequence number now for next exposure
+        if self.save_file:
+            self.increment_filenumber()
+
+        self.exposure_flag = self.exposureflags["NONE"]
+
+        return
+
+    def write_image_async(self, image, LocalFile, receive_thread, exposure_header):
+        """
+        Wait for image data to be received, then write and display image.
+        exposure_header is the image's copy of the exposure header.
+        Run on a background thread.
+        """
+
+        if receive_thread is not None:
+            receive_thread.join()
+
+        if self.receive_error is not None:
+            azcam.log(f"ERROR image {LocalFile} not written")
+            return
+
+        try:
+            if self.amp_statistics_keywords and exposure_header is not None:
+                self.set_amp_statistics_keywords(exposure_header)
+
+            if self.save_file:
+                azcam.log("Writing %s" % LocalFile)
+                image.overwrite = self.overwrite
+                image.test_image = self.test_image
+                image.write_file(LocalFile, self.filetype)
+                azcam.log("Writing finished", level=2)
+                image.written = 1
+
+                if self.guide_mode:
+                    self.send_image(LocalFile)
+                elif self.send_image:
+                    azcam.log("Sending image")
+                    self.send_image(LocalFile)
+
+            image.toggle = 1
+
+            if self.display_image:
+                azcam.log("Displaying image")
+                azcam.db.display.display(image)
+
+        except Exception as e:
+            azcam.log(f"ERROR writing image {LocalFile}: {e}")
+
+        return
+
+    def copy_image_header(self, image):
+        """
+        Replace the header of image with a copy of it and of its header items, which
+        are the shared azcam.db.headers objects.
+        Returns the copy of the exposure header, or None if not an item.
+        """
+
+        memo = {}
+        image.header = copy.deepcopy(image.header, memo)
+
+        exposure_header = azcam.db.headers.get("exposure")
+        if exposure_header is None:
+            return None
+
+        return memo.get(id(exposure_header))
+
+    def wait_receive_async(self):
+        """
+        Wait for the background receive and write of the last image to finish.
+        Raises the error of a failed receive.
+        """
+
+        for thread in [self.receive_thread, self.write_thread]:
+            if thread is not None:
+                thread.join()
+
+        self.receive_thread = None
+        self.write_thread = None
+
+        self.check_receive_error()
+
+        return
+
+    def check_receive_error(self):
+        """
+        Raise the error of a failed background receive, once.
+        """
+
+        error = self.receive_error
+        if error is None:
+            return
+
+        self.receive_error = None
+        self.receive_thread = None
+        self.exposure_flag = self.exposureflags["NONE"]
+
+        raise error
+
+    def swap_image_buffers(self, focalplane=None):
+        """
+        Make the alternate image the current image, so the next exposure does not
+        overwrite the image still being received and written.
+        focalplane is given to the new current image, so the image being written may
+        keep a copy. Both images have their own header and data.
+        """
+
+        if self.image_alternate is None:
+            self.image_alternate = copy.copy(self.image)
+            self.image_alternate.header = copy.deepcopy(self.image.header)
+            self.image_alternate.data = None
+
+        if (
+            self.image_alternate.data is None
+            or self.image_alternate.data.shape != self.image.data.shape
+        ):
+            self.image_alternate.data = numpy.empty_like(self.image.data)
+
+        if focalplane is not None:
+            self.image_alternate.focalplane = focalplane
+
+        self.image, self.image_alternate = self.image_alternate, self.image
+
+        return
+
+    def set_shared_image_state(self, state):
+        """
+        Set the state of the shared memory image, unless already aborted.
+        """
+
+        if not self.shared_image.enabled:
+            return
+
+        if self.shared_image.descriptor.get("state") != "aborted":
+            self.shared_image.set_state(state)
+
+        return
+
+    # **********************************************************************************************
+    # amplifier statistics
+    # **********************************************************************************************
+
+    def get_amp_statistics(self):
+        """
+        Return per-amplifier statistics of the last received image as a dictionary of
+        lists with one value per image amplifier, or {} if not enabled.
+        """
+
+        if self.mosaic_camservers and not azcam.db.controller.camserver.demo_mode:
+            receivers = self.mosaic_receivers
+        else:
+            receivers = [self.receive_data]
+
+        stats = {}
+        for receiver in receivers:
+            if not receiver.amp_statistics.enabled:
+                continue
+            for key, values in receiver.amp_statistics.get_statistics().items():
+                stats.setdefault(key, []).extend(values)
+
+        return stats
+
+    def set_amp_statistics_keywords(self, header=None):
+        """
+        Write amplifier statistics of the last received image as exposure header keywords.
+        header is the header to write to, default is the exposure header.
+        """
+
+        if header is None:
+            header = azcam.db.headers["exposure"]
+        stats = self.amp_statistics
+
+        for amp in range(len(stats.get("mean", []))):
+            num = amp + 1
+            header.set_keyword(
+                f"AMEAN{num}", round(stats["mean"][amp], 2), f"Amp {num} mean", float
+            )
+            header.set_keyword(
+                f"AMED{num}", stats["median"][amp], f"Amp {num} median estimate", float
+            )
+            header.set_keyword(
+                f"ABIAS{num}",
+                round(stats["bias"][amp], 2),
+                f"Amp {num} overscan bias",
+                float,
+            )
+            header.set_keyword(
+                f"ASAT{num}",
+                stats["saturated"][amp],
+                f"Amp {num} saturated pixels",
+                int,
+            )
+
+        return
+
+    # **********************************************************************************************
+    # mosaic readout
+    # **********************************************************************************************
+
+    def get_mosaic_receivers(self):
+        """
+        Return a ReceiveData object for each mosaic camera server.
+        Each receives its amplifiers into its own rows of the combined image data,
+        in the order of mosaic_camservers.
+        """
+
+        numservers = len(self.mosaic_camservers)
+        numamps_image = self.image.focalplane.numamps_image
+
+        if self.mosaic_numamps:
+            numamps = list(self.mosaic_numamps)
+        else:
+            numamps = [numamps_image // numservers] * numservers
+
+        if len(numamps) != numservers or sum(numamps) != numamps_image:
+            raise azcam.AzcamError(
+                f"Mosaic amplifiers {numamps} do not match {numamps_image} image amplifiers"
+            )
+
+        while len(self.mosaic_receivers) < numservers:
+            self.mosaic_receivers.append(ReceiveData(self))
+
+        amp_start = 0
+        for index, (receiver, camserver, amps) in enumerate(
+            zip(self.mosaic_receivers, self.mosaic_camservers, numamps)
+        ):
+            receiver.camserver = camserver
+            receiver.copy_settings(self.receive_data, index)
+            receiver.abort_event = self.receive_data.abort_event
+            receiver.amp_start = amp_start
+            receiver.numamps = amps
+            receiver.data_order = self.get_mosaic_data_order(amp_start, amps)
+            amp_start += amps
+
+        return self.mosaic_receivers[:numservers]
+
+    def get_mosaic_data_order(self, amp_start, numamps):
+        """
+        Return the data order of one mosaic controller, whose amplifiers are image
+        amplifiers amp_start through amp_start+numamps-1.
+        data_order entries are positions in the data streams of all controllers in turn,
+        so the entries for these amplifiers must be in the same range.
+        """
+
+        data_order = list(self.data_order or [])
+        if len(data_order) == 0:
+            return []
+
+        order = data_order[amp_start : amp_start + numamps]
+        if len(order) != numamps or not all(
+            amp_start <= x < amp_start + numamps for x in order
+        ):
+            raise azcam.AzcamError(
+                f"data_order {data_order} does not keep amplifiers "
+                f"{amp_start} to {amp_start + numamps - 1} on one mosaic controller"
+            )
+
+        return [x - amp_start for x in order]
+
+    def get_mosaic_others(self):
+        """
+        Return the mosaic camera servers other than the controller's own.
+        """
+
+        return [
+            camserver
+            for camserver in self.mosaic_camservers
+            if camserver is not azcam.db.controller.camserver
+        ]
+
+    def command_mosaic(self, command, controller_command):
+        """
+        Call controller_command for the controller and send command to all other mosaic
+        camera servers together.
+        """
+
+        camservers = self.get_mosaic_others()
+        if not camservers:
+            controller_command()
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(len(camservers) + 1) as executor:
+            futures = [executor.submit(controller_command)]
+            for camserver in camservers:
+                futures.append(executor.submit(camserver.command, command))
+
+            # raises the first error after all commands have been sent
+            for future in futures:
+                future.result()
+
+        return
+
+    def start_exposure_mosaic(self):
+        """
+        Start integration on all mosaic camera servers together.
+        """
+
+        # other controllers integrate for the exposure time written to the controller
+        et_msec = int(azcam.db.controller.exposure_time * 1000)
+        for camserver in self.get_mosaic_others():
+            if camserver.get_cached("ExposureTime") != ["OK", str(et_msec)]:
+                camserver.set("ExposureTime", et_msec)
+
+        self.command_mosaic("StartExposure", azcam.db.controller.start_exposure)
+
+        return
+
+    def start_readout_mosaic(self):
+        """
+        Start readout on all mosaic camera servers together.
+        """
+
+        receivers = self.get_mosaic_receivers()
+        numpix_amp = self.image.focalplane.numpix_amp
+
+        # each controller reads only its own amplifiers, PixelCount counts up to this
+        for receiver in receivers:
+            numpix = receiver.numamps * numpix_amp
+            camserver = receiver.camserver
+            if camserver.get_cached("NumberPixelsImage") != ["OK", str(numpix)]:
+                camserver.set("NumberPixelsImage", numpix)
+
+        with concurrent.futures.ThreadPoolExecutor(len(receivers)) as executor:
+            futures = []
+            for receiver in receivers:
+                receiver.readout_start_time = time.perf_counter()
+                futures.append(executor.submit(receiver.camserver.command, "ReadImage"))
+
+            # raises the first error after all commands have been sent
+            for future in futures:
+                future.result()
+
+        return
+
+    def receive_image_mosaic(self, image):
+        """
+        Receive image data from all mosaic camera servers concurrently into image.
+        """
+
+        if azcam.db.controller.camserver.demo_mode:
+            self.receive_data.receive_image_data(
+                self.receive_data.get_data_size(image.focalplane.numpix_image), image
+            )
+            return
+
+        return run_coroutine(self.receive_image_mosaic_async(image))
+
+    async def receive_image_mosaic_async(self, image):
+        """
+        Receive image data from all mosaic camera servers concurrently, awaitable version.
+        All transfers run to completion before the first error is raised.
+        """
+
+        receivers = self.get_mosaic_receivers()
+        numpix_amp = image.focalplane.numpix_amp
+
+        results = await asyncio.gather(
+            *[
+                receiver.receive_image_data_async(
+                    receiver.get_data_size(receiver.numamps * numpix_amp), image
+                )
+                for receiver in receivers
+            ],
+            return_exceptions=True,
+        )
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return
+
+    def get_pixels_remaining_mosaic(self):
+        """
+        Return the number of pixels remaining to be read on all mosaic controllers.
+        """
+
+        numpix_amp = self.image.focalplane.numpix_amp
+
+        remaining = 0
+        for receiver in self.get_mosaic_receivers():
+            reply = receiver.camserver.get("PixelCount")
+            remaining += max(0, receiver.numamps * numpix_amp - int(reply[1]))
+
+        return remaining
+
     def abort(self):
         """
         Abort an exposure in progress.
@@ -0,0 +1,164 @@
+"""
+Contains the PixelFormat class.
+"""
+
+import math
+
+import numpy
+
+import azcam
+
+
+class PixelFormat(object):
+    """
+    Wire format of image data pixels sent by the controller server.
+    Packed formats are little-endian bit streams, first pixel in the lowest bits.
+    Packed pixels are unpacked in groups which start on a byte boundary, with one
+    vectorized operation per pixel position in the group.
+    """
+
+    # name: (bits per pixel, packed, signed)
+    FORMATS = {
+        "u16": (16, 0, 0),
+        "p18": (18, 1, 0),
+        "p20": (20, 1, 0),
+        "p24": (24, 1, 0),
+        "u32": (32, 0, 0),
+        "i32": (32, 0, 1),
+    }
+
+    def __init__(self, name="u16", shift=0):
+
+        # bits to shift each pixel right after unpacking, for example 2 to fit p18 in <u2
+        self.shift = shift
+
+        self.set_format(name)
+
+    def set_format(self, name):
+        """
+        Set wire format, a key of FORMATS.
+        """
+
+        try:
+            self.bits, self.packed, self.signed = self.FORMATS[name]
+        except KeyError:
+            raise azcam.AzcamError(f"Unknown pixel format {name}")
+
+        self.name = name
+
+        # pixels and bytes in a packing group, which starts on a byte boundary
+        group_bits = self.bits * 8 // math.gcd(self.bits, 8)
+        self.group_pixels = group_bits // self.bits
+        self.group_bytes = group_bits // 8
+
+        return
+
+    def is_native(self, dtype):
+        """
+        Return True if wire data can be received directly into a buffer of dtype.
+        """
+
+        return (
+            self.name == "u16" and self.shift == 0 and numpy.dtype(dtype).str == "<u2"
+        )
+
+    def get_bytes(self, numpix):
+        """
+        Return number of bytes sent for numpix pixels.
+        """
+
+        return (numpix * self.bits + 7) // 8
+
+    def get_buffer_bytes(self, numpix):
+        """
+        Return size of a receive buffer for numpix pixels, padded to whole packing groups.
+        """
+
+        groups = (numpix + self.group_pixels - 1) // self.group_pixels
+
+        return groups * self.group_bytes
+
+    def get_pixels(self, nbytes, numpix):
+        """
+        Return number of pixels which can be unpacked from the first nbytes of an image
+        of numpix pixels.
+        """
+
+        if nbytes >= self.get_bytes(numpix):
+            return numpix
+
+        return min(numpix, nbytes // self.group_bytes * self.group_pixels)
+
+    def unpack(self, raw, out, start, stop):
+        """
+        Unpack pixels start through stop-1 from raw, a uint8 buffer of wire data,
+        into out[start:stop]. start must be at a packing group boundary.
+        """
+
+        if stop <= start:
+            return
+
+        group = start // self.group_pixels
+        lastgroup = (stop + self.group_pixels - 1) // self.group_pixels
+        data = raw[group * self.group_bytes : lastgroup * self.group_bytes]
+
+        if not self.packed:
+            dtype = {16: "<u2", 32: "<i4" if self.signed else "<u4"}[self.bits]
+            values = data.view(dtype)
+        else:
+            data = data.reshape(-1, self.group_bytes)
+            values = numpy.empty((data.shape[0], self.group_pixels), dtype="<u4")
+            mask = (1 << self.bits) - 1
+            for pixel in range(self.group_pixels):
+                offset, bitshift = divmod(pixel * self.bits, 8)
+                nbytes = (bitshift + self.bits + 7) // 8
+                value = data[:, offset].astype("<u4")
+                for byte in range(1, nbytes):
+                    value |= data[:, offset + byte].astype("<u4") << (8 * byte)
+                values[:, pixel] = (value >> bitshift) & mask
+            values = values.reshape(-1)
+
+        first = start - group * self.group_pixels
+        values = values[first : first + stop - start]
+
+        if self.shift:
+            values = values >> self.shift
+
+        # clip to the range of an integer target rather than wrapping
+        target = out.dtype
+        if target.kind in "ui" and values.dtype != target:
+            info = numpy.iinfo(target)
+            values = numpy.clip(
+                values, max(info.min, numpy.iinfo(values.dtype).min), info.max
+            )
+
+        out[start:stop] = values
+
+        return
+
+    def pack(self, values):
+        """
+        Return pixel values packed in this wire format as a uint8 array.
+        Used by the camera server simulator.
+        """
+
+        values = numpy.asarray(values)
+
+        if not self.packed:
+            dtype = {16: "<u2", 32: "<i4" if self.signed else "<u4"}[self.bits]
+            return values.astype(dtype, copy=False).view("u1")
+
+        numgroups = (values.size + self.group_pixels - 1) // self.group_pixels
+        padded = numpy.zeros(numgroups * self.group_pixels, dtype="<u8")
+        padded[: values.size] = values
+        padded &= (1 << self.bits) - 1
+        padded = padded.reshape(numgroups, self.group_pixels)
+
+        data = numpy.zeros((numgroups, self.group_bytes), dtype="u1")
+        for pixel in range(self.group_pixels):
+            offset, bitshift = divmod(pixel * self.bits, 8)
+            value = padded[:, pixel] << bitshift
+            for byte in range((bitshift + self.bits + 7) // 8):
+                data[:, offset + byte] |= ((value >> (8 * byte)) & 0xFF).astype("u1")
+
+        return data.reshape(-1)[: self.get_bytes(values.size)]
@@ -0,0 +1,190 @@
+"""
+Contains the QuickLook class.
+"""
+
+import numpy
+
+from .deinterlace import Deinterlacer
+from .shared_image import (
+    attach_shared_memory,
+    close_shared_memory,
+    create_shared_memory,
+    get_amp_geometry,
+)
+
+
+class QuickLook(object):
+    """
+    Decimated preview of an image, updated as image data is received.
+    Every row_step-th row of each amplifier is deinterlaced into a small preview array
+    of shape [numamps, numrows, numcols_amp] as soon as the row has been received.
+    If shared_name is set the preview is in a shared memory block which other processes
+    can open with QuickLook.attach(shared_name).
+    """
+
+    # int64 header fields at the start of the shared memory block
+    HEADER = ["frame", "rows_ready", "numamps", "numrows", "numcols", "row_step"]
+    HEADER_BYTES = 64
+
+    def __init__(self):
+
+        # True to update the preview during readout
+        self.enabled = 0
+        # preview every row_step-th row of each amplifier
+        self.row_step = 16
+        # shared memory block name, "" for a preview in this process only
+        self.shared_name = ""
+
+        # preview data, shape [numamps, numrows, numcols]
+        self.preview = None
+        # header values, see HEADER
+        self.header = None
+        self.shared_memory = None
+
+        # number of readouts started
+        self.frame = 0
+        # number of preview rows filled for this readout
+        self.rows_ready = 0
+
+        self.numamps = 0
+        self.numcols = 0
+        self.numrows = 0
+        self.data_order = []
+        self.deinterlacer = Deinterlacer()
+
+    def start(self, focalplane, numamps, numpix_amp, data_order=[]):
+        """
+        Prepare the preview for a new readout.
+        numamps and numpix_amp are for the received data stream.
+        """
+
+        numrows_amp, numcols = get_amp_geometry(focalplane, numpix_amp)[:2]
+        numrows = (numrows_amp + self.row_step - 1) // self.row_step
+        shape = (numamps, numrows, numcols)
+
+        if self.preview is None or self.preview.shape != shape:
+            self.allocate(shape)
+
+        self.numamps = numamps
+        self.numcols = numcols
+        self.numrows = numrows
+        self.data_order = data_order
+        self.frame += 1
+        self.rows_ready = 0
+
+        self.header[:] = 0
+        self.header[: len(self.HEADER)] = [
+            self.frame,
+            0,
+            numamps,
+            numrows,
+            numcols,
+            self.row_step,
+        ]
+
+        return
+
+    def allocate(self, shape):
+        """
+        Allocate preview and header arrays, in shared memory if shared_name is set.
+        """
+
+        self.close()
+
+        if not self.shared_name:
+            self.header = numpy.zeros(self.HEADER_BYTES // 8, dtype="<i8")
+            self.preview = numpy.zeros(shape, dtype="<u2")
+            return
+
+        size = self.HEADER_BYTES + 2 * int(numpy.prod(shape))
+        self.shared_memory = create_shared_memory(self.shared_name, size)
+
+        self.header, self.preview = self.get_arrays(self.shared_memory.buf, shape)
+
+        return
+
+    def update(self, buffer, groups):
+        """
+        Deinterlace preview rows which are complete in buffer.
+        groups is the number of pixel groups (one pixel from each amplifier) received.
+        """
+
+        rowsize = self.numcols * self.numamps
+
+        while self.rows_ready < self.numrows:
+            row = self.rows_ready * self.row_step
+            if (row + 1) * self.numcols > groups:
+                break
+
+            block = buffer[row * rowsize : (row + 1) * rowsize]
+            if block.dtype != self.preview.dtype:  # wide pixels, clip for preview
+                block = numpy.clip(block, 0, 65535).astype(self.preview.dtype)
+
+            self.deinterlacer.deinterlace(
+                block,
+                self.preview[:, self.rows_ready, :],
+                self.numamps,
+                self.numcols,
+                self.data_order,
+            )
+            self.rows_ready += 1
+
+        # readers use rows_ready after the data is written
+        self.header[1] = self.rows_ready
+
+        return
+
+    def get_preview(self):
+        """
+        Return a view of the preview rows filled so far, no data is copied.
+        """
+
+        if self.preview is None:
+            return None
+
+        return self.preview[:, : self.rows_ready, :]
+
+    def close(self):
+        """
+        Release the preview and its shared memory block.
+        """
+
+        self.preview = None
+        self.header = None
+
+        if self.shared_memory is not None:
+            close_shared_memory(self.shared_memory)
+            self.shared_memory = None
+
+        return
+
+    @classmethod
+    def get_arrays(cls, buf, shape):
+        """
+        Return (header, preview) arrays on a shared memory buffer.
+        """
+
+        header = numpy.ndarray(shape=(cls.HEADER_BYTES // 8,), dtype="<i8", buffer=buf)
+        preview = numpy.ndarray(
+            shape=shape, dtype="<u2", buffer=buf, offset=cls.HEADER_BYTES
+        )
+
+        return header, preview
+
+    @classmethod
+    def attach(cls, shared_name):
+        """
+        Open a preview published by another process.
+        Returns (shared_memory, header, preview), where header and preview are live
+        views of the shared block, header fields are in HEADER order and
+        preview[:, : header[1], :] are the rows filled so far.
+        Close shared_memory when done, but do not unlink it.
+        """
+
+        shm = attach_shared_memory(shared_name)
+
+        header, _ = cls.get_arrays(shm.buf, (0, 0, 0))
+        shape = tuple(int(x) for x in header[2:5])
+        header, preview = cls.get_arrays(shm.buf, shape)
+
+        return shm, header, preview
@@ -1,16 +1,92 @@
+import asyncio
+import collections
+import select
 import socket
+import tempfile
+import threading
 import time
 
 import numpy
 
 import azcam
 
+from .amp_statistics import AmpStatistics
+from .buffer_pool import BufferPool
+from .deinterlace import Deinterlacer
+from .pixel_format import PixelFormat
+from .quick_look import QuickLook
+from .receive_metrics import ReceiveMetrics
+from .synthetic_image import SyntheticImage
+
+# event loop for all image data sockets, see get_event_loop()
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Return the event loop used for image data sockets, started on first use.
+    It runs for the life of the process on its own thread, so a socket is always
+    used from the same loop, as required by the Windows proactor event loop.
+    """
+
+    global _event_loop
+
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_event_loop.run_forever, name="receivedata", daemon=True
+            ).start()
+
+    return _event_loop
+
+
+def run_coroutine(coro):
+    """
+    Run a coroutine in the image data event loop and return its result.
+    Callable from any thread except the event loop thread.
+    """
+
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
 
 class ReceiveData(object):
     """
     Exposure subclass to receive image data.
     """
 
+    # user settings shared by the receivers of a mosaic camera, see copy_settings()
+    SETTINGS = [
+        "persistent_socket",
+        "connect_timeout",
+        "deinterlace_mode",
+        "streaming_deinterlace",
+        "RecBufferSize",
+        "zero_copy",
+        "pixel_format",
+        "image_dtype",
+        "pipeline_depth",
+        "adaptive_chunks",
+        "chunk_time",
+        "RecBufferSizeMin",
+        "RecBufferSizeMax",
+        "memmap_folder",
+        "metrics_file",
+        "first_byte_timeout",
+        "chunk_timeout",
+        "retry_delay",
+        "abort_check_time",
+        "resume_transfer",
+        "resume_retries",
+        "resume_delay",
+    ]
+
     def __init__(self, exposure):
 
         self.exposure = exposure  # upper level exposure object
@@ -22,8 +98,22 @@ class ReceiveData(object):
         self.PixelsReadout = 0
         self.pixels_remaining = 0
         self.pixels_remaining = 0
+        # camera server interface for image data, 0 for azcam.db.controller.camserver
         self.camserver = 0
         self.socket = 0
+        # True to keep the data socket connected between readouts
+        self.persistent_socket = 0
+        # seconds to wait for the data socket to connect
+        self.connect_timeout = 5.0
+        # True while image data is being received
+        self.receiving = 0
+        # event set to abort this readout, None to check exposure_flag
+        # a background receive has its own event so a later exposure cannot abort it
+        self.abort_event = None
+        # image being received
+        self.image = None
+        # synthetic image generator for demo mode
+        self.synthetic_image = SyntheticImage()
 
         # Deinterlace mode
         self.deinterlace_mode = 1
@@ -31,143 +121,668 @@ class ReceiveData(object):
         self.numpix_amp = 0
         # Number of amplifiers
         self.numamps_image = 0
+        # first image amplifier received by this object, for mosaic readout
+        self.amp_start = 0
+        # number of image amplifiers received by this object, 0 for all
+        self.numamps = 0
+        # amplifier data order, None for exposure.data_order
+        self.data_order = None
+        # deinterlace engine with cached amplifier index maps
+        self.deinterlacer = Deinterlacer()
+        # time to deinterlace last image, seconds
+        self.deinterlace_time = 0.0
+        # True to deinterlace each chunk of data as it is received
+        self.streaming_deinterlace = 0
+        # number of pixel groups (one pixel from each amplifier) deinterlaced so far
+        self.groups_deinterlaced = 0
+        # decimated preview updated during readout, set quick_look.enabled to use
+        self.quick_look = QuickLook()
+        # per-amplifier statistics of last readout, set amp_statistics.enabled to use
+        self.amp_statistics = AmpStatistics()
 
         # using this helps writing efficiency, bytes
         self.RecBufferSize = 5 * 1024 * 1024
 
-    def receive_image_data(self, data_size):
+        # True to receive data directly into the image buffer (no intermediate copies)
+        self.zero_copy = 0
+
+        # reusable receive buffers, see buffer_pool.get_counters() for reuse
+        self.buffer_pool = BufferPool()
+
+        # wire format of image data pixels, see PixelFormat.FORMATS
+        self.pixel_format = PixelFormat()
+        # image data dtype, such as "<u4" for wide pixels, "" to keep image.data dtype
+        self.image_dtype = ""
+        # reusable buffers of wire data for formats which are unpacked
+        self.wire_pool = BufferPool()
+        self.wire_buffer = None
+
+        # number of GetImageData requests kept outstanding, 1 is no pipelining
+        self.pipeline_depth = 1
+        # True to size data requests from measured throughput
+        self.adaptive_chunks = 0
+        # target transfer time of one adaptive data request, seconds
+        self.chunk_time = 0.05
+        # minimum and maximum adaptive data request sizes, bytes
+        self.RecBufferSizeMin = 256 * 1024
+        self.RecBufferSizeMax = 64 * 1024 * 1024
+        # current adaptive data request size, bytes
+        self.chunk_size = self.RecBufferSize
+        # sizes of outstanding data requests, bytes
+        self.requests = collections.deque()
+        # time last data frame was received
+        self.frame_time = 0.0
+
+        # folder for memory-mapped receive buffer and image data, "" to use RAM
+        self.memmap_folder = ""
+        # memory-mapped receive buffer
+        self.memmap_buffer = None
+
+        # transfer metrics of last readout
+        self.metrics = ReceiveMetrics()
+        # file to which metrics of each readout are appended, "" for none
+        self.metrics_file = ""
+        # time.perf_counter() when ReadImage was sent, set by exposure
+        self.readout_start_time = 0.0
+
+        # seconds to wait for the first image data after readout starts
+        self.first_byte_timeout = 30.0
+        # seconds to wait for more image data once data is flowing
+        self.chunk_timeout = 10.0
+        # seconds before requesting again when the controller server has no data ready
+        self.retry_delay = 0.01
+        # longest wait without checking for an abort, seconds
+        self.abort_check_time = 0.5
+        # time.perf_counter() after which the receive times out
+        self.deadline = 0.0
+
+        # True to reconnect after a stall and continue from the last byte received
+        # the controller server must confirm "ResumeImageData offset", see confirm_resume()
+        self.resume_transfer = 0
+        # maximum number of resumes for one readout
+        self.resume_retries = 3
+        # seconds to wait before reconnecting
+        self.resume_delay = 0.5
+
+    def copy_settings(self, receive_data, index=0):
+        """
+        Copy user settings from another ReceiveData object, for mosaic readout.
+        index is appended to the quick look shared memory name so each receiver
+        has its own preview.
+        """
+
+        for name in self.SETTINGS:
+            setattr(self, name, getattr(receive_data, name))
+
+        for name in ["enabled", "saturation", "hist_shift"]:
+            setattr(
+                self.amp_statistics, name, getattr(receive_data.amp_statistics, name)
+            )
+
+        self.quick_look.enabled = receive_data.quick_look.enabled
+        self.quick_look.row_step = receive_data.quick_look.row_step
+        if receive_data.quick_look.shared_name:
+            self.quick_look.shared_name = (
+                f"{receive_data.quick_look.shared_name}{index}"
+            )
+        else:
+            self.quick_look.shared_name = ""
+
+        return
+
+    def get_data_size(self, numpix):
+        """
+        Return number of bytes sent by the controller server for numpix pixels.
+        """
+
+        return self.pixel_format.get_bytes(numpix)
+
+    def prepare_image(self, image):
+        """
+        Reallocate image.data if image_dtype is set and differs from its dtype.
+        """
+
+        if self.image_dtype and image.data.dtype != numpy.dtype(self.image_dtype):
+            image.data = numpy.zeros(image.data.shape, dtype=self.image_dtype)
+
+        return
+
+    def receive_image_data(self, data_size, image=None):
         """
         Receive binary image data from controller server.
+        data_size is bytes, see get_data_size().
+        image is the image to receive into, default is exposure.image.
+        Runs receive_image_data_async() in the image data event loop.
+        """
+
+        return run_coroutine(self.receive_image_data_async(data_size, image))
+
+    async def receive_image_data_async(self, data_size, image=None):
+        """
+        Receive binary image data from controller server, awaitable version.
         data_size is bytes.
+        image is the image to receive into, default is exposure.image.
         """
 
-        if azcam.db.controller.camserver.demo_mode:
+        # image is fixed here as exposure.image may change during a background receive
+        if image is None:
+            image = self.exposure.image
+        self.image = image
+        self.prepare_image(image)
+
+        if self.get_camserver().demo_mode:
             self.mock_data()
+            if self.amp_statistics.enabled:
+                self.amp_statistics.start(
+                    self.image.focalplane,
+                    self.image.focalplane.numamps_image,
+                    self.image.focalplane.numpix_amp,
+                )
+                self.amp_statistics.update_block(self.image.data.T, 0)
+            return
+
+        # use the socket connected during integration if still good
+        self.receiving = 1
+        BufferTemp = None
+        try:
+            await self.connect_async()
+
+            azcam.log(f"Receiving image data: {data_size} bytes", level=3)
+
+            # Init Deinterlace
+            self.numamps_image = self.numamps or self.image.focalplane.numamps_image
+            self.numpix_amp = self.image.focalplane.numpix_amp
+
+            reqCnt = min(
+                data_size - 17, self.RecBufferSize - 17
+            )  # 17 bytes for the data frame size (%16d + space)
+            dataCnt = 0  # receved data counter
+            getData = b""
+            totalpixels = self.numamps_image * self.numpix_amp
+            self.PixelsReadout = 0
+            self.pixels_remaining = totalpixels
+            self.groups_deinterlaced = 0
+            self.deinterlace_time = 0.0
+            self.metrics.reset(data_size, self.readout_start_time)
+
+            # images could be slow to start
+            self.deadline = self.metrics.readout_start_time + self.first_byte_timeout
+
+            # get temporary image buffer, reused when geometry is unchanged
+            BufferTemp = self.get_buffer(totalpixels, self.image.data.dtype)
+
+            if self.quick_look.enabled:
+                self.quick_look.start(
+                    self.image.focalplane,
+                    self.numamps_image,
+                    self.numpix_amp,
+                    self.get_data_order(),
+                )
+            if self.amp_statistics.enabled:
+                self.amp_statistics.start(
+                    self.image.focalplane,
+                    self.numamps_image,
+                    self.numpix_amp,
+                    self.get_data_order(),
+                )
+
+            # byte view of the buffer so data can be received directly into it
+            # pipelined transfers always receive directly into the buffer
+            # other wire formats are received into a byte buffer and unpacked into BufferTemp
+            native = self.pixel_format.is_native(BufferTemp.dtype)
+            direct = (
+                self.zero_copy
+                or self.pipeline_depth > 1
+                or self.adaptive_chunks
+                or not native
+            )
+            if not native:
+                self.wire_buffer = self.wire_pool.get(
+                    self.pixel_format.get_buffer_bytes(totalpixels), "u1"
+                )
+                BufferView = memoryview(self.wire_buffer)
+                self.requests.clear()
+                self.frame_time = time.perf_counter()
+            elif direct:
+                BufferView = memoryview(BufferTemp).cast("B")
+                self.requests.clear()
+                self.frame_time = time.perf_counter()
+
+            # set image data pointer
+            ptrData = 0
+            resumes = 0
+
+            # loop over data just read until all received or timeout
+            while dataCnt < data_size:
+
+                # check if aborted by user (from abort() - controller.abort()
+                if self.abort_requested():
+                    # break out of read loop
+                    self.readout_abort()  # stop ControllerServer
+                    break
+
+                stalled = time.perf_counter() > self.deadline or not self.socket
+                if not stalled:
+                    try:
+                        if direct:
+                            len1 = await self.request_data_pipelined(
+                                BufferView[dataCnt:], data_size - dataCnt
+                            )
+                        else:
+                            getData = await self.request_data(
+                                reqCnt + 17
+                            )  # request data + 17 bytes for data length
+                            len1 = len(getData)
+                    except OSError as e:
+                        azcam.log(f"Image data connection failed: {e}", level=2)
+                        stalled = True
+
+                if stalled:
+                    if self.resume_transfer and resumes < self.resume_retries:
+                        # continue from last complete byte (pixel for copied data)
+                        if not direct:
+                            dataCnt = ptrData * 2
+                            reqCnt = min(
+                                data_size - dataCnt - 17, self.RecBufferSize - 17
+                            )
+                        resumes += 1
+                        await self.resume_async(dataCnt)
+                        continue
+                    azcam.log("Timeout waiting for image data", level=2)
+                    break
+                azcam.log(
+                    f"Readout: {self.pixels_remaining:10d} pixels remaining", level=3
+                )
+
+                if len1 != 0:
+                    self.metrics.add_chunk(len1)
+                    dataCnt += len1
+                    self.deadline = time.perf_counter() + self.chunk_timeout
+
+                    if not native:
+                        # unpack complete pixels, partial packing group waits for next chunk
+                        pixels = self.pixel_format.get_pixels(dataCnt, totalpixels)
+                        self.pixel_format.unpack(
+                            self.wire_buffer, BufferTemp, ptrData, pixels
+                        )
+                        pixelsreadout = pixels - ptrData
+                    elif direct:
+                        # data is already in BufferTemp, may end on an odd byte
+                        pixelsreadout = int(dataCnt / 2) - ptrData
+                    else:
+                        # store data
+                        pixelsreadout = int(
+                            len1 / 2
+                        )  # number pixels in this read now available
+
+                        # convert received data to unsigned shorts
+                        ImageBufferTemp = numpy.ndarray(
+                            shape=(1, pixelsreadout), dtype="<u2", buffer=getData
+                        )
+
+                        # copy the data into TempBuffer
+                        BufferTemp[ptrData : ptrData + pixelsreadout] = ImageBufferTemp[
+                            0:pixelsreadout
+                        ]
+                    ptrData = ptrData + pixelsreadout
+
+                    # deinterlace complete pixel groups now, partial group waits for next chunk
+                    if self.streaming_deinterlace:
+                        self.deinterlace_groups(
+                            BufferTemp, ptrData // self.numamps_image
+                        )
+
+                    if self.quick_look.enabled:
+                        self.quick_look.update(
+                            BufferTemp, ptrData // self.numamps_image
+                        )
+                    if self.amp_statistics.enabled:
+                        self.amp_statistics.update(
+                            BufferTemp, ptrData // self.numamps_image
+                        )
+
+                    reqCnt = min(data_size - dataCnt - 17, self.RecBufferSize - 17)
+                    self.PixelsReadout = self.PixelsReadout + pixelsreadout
+                    self.pixels_remaining = self.pixels_remaining - pixelsreadout
+                else:
+                    # controller server has no data ready yet
+                    await asyncio.sleep(self.retry_delay)
+                    self.metrics.retries += 1
+
+            # check if all data has been received
+            if dataCnt == data_size:
+                self.valid = 1
+                self.pixels_remaining = 0
+                azcam.log("Image data received")
+            else:
+                self.finish_metrics()
+                if self.abort_event is not None:
+                    aborted = self.abort_event.is_set()
+                else:
+                    aborted = (
+                        azcam.db.exposure.exposure_flag
+                        == azcam.db.exposure.exposureflags["ABORT"]
+                    )
+                if not aborted:
+                    s = "ERROR in ReceiveImageData: Received %d of %d bytes" % (
+                        dataCnt,
+                        data_size,
+                    )
+                    raise azcam.AzcamError(s)
+                else:
+                    raise azcam.AzcamError(
+                        "Aborted in receive_image_data", error_code=3
+                    )
+
+            # deinterlace remaining pixel groups into image.data
+            self.deinterlace_groups(BufferTemp, self.numpix_amp)
+            self.finish_metrics()
+        except BaseException:
+            # a failed or aborted transfer leaves the connection in an unknown state
+            self.close()
+            raise
+        finally:
+            if BufferTemp is not None:
+                self.release_buffer(BufferTemp)
+            self.receiving = 0
+
+        if not self.persistent_socket:
+            self.close()
+
+        return
+
+    async def resume_async(self, offset):
+        """
+        Reconnect the data socket after a stall so the transfer continues at byte offset.
+        Data already received is kept. A failed connection is left closed, so the
+        receive loop tries again while resumes remain.
+        """
+
+        azcam.log(f"Resuming image data transfer at byte {offset}", level=2)
+        self.metrics.resumes += 1
+
+        self.close()
+        self.requests.clear()
+
+        await asyncio.sleep(self.resume_delay)
+        self.deadline = time.perf_counter() + self.chunk_timeout
+        try:
+            await self.connect_async()
+        except (OSError, asyncio.TimeoutError) as e:
+            azcam.log(f"Could not reconnect image data socket: {e}", level=2)
             return
 
-        # create a new socket for binary data and connect to the controller server
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        await self.confirm_resume_async(offset)
+
+        return
+
+    async def confirm_resume_async(self, offset):
+        """
+        Ask the controller server to continue the transfer at byte offset.
+        The server replies with a frame header holding the offset it will send from
+        next, "%16d ". The readout fails if the reply is missing or differs, as the
+        rest of the data would then be placed at the wrong offset.
+        """
 
-        self.socket.connect(
-            (azcam.db.controller.camserver.host, azcam.db.controller.camserver.port)
+        await asyncio.get_running_loop().sock_sendall(
+            self.socket, str.encode(f"ResumeImageData {offset}\n")
         )
 
-        azcam.log(f"Receiving image data: {data_size} bytes", level=3)
+        header = bytearray(17)
+        cnt = await self._recv_into(memoryview(header))
+        try:
+            reply = int(header[0:16]) if cnt == 17 else None
+        except ValueError:
+            reply = None
+
+        if reply != offset:
+            raise azcam.AzcamError(
+                f"ERROR controller server did not resume image data at byte {offset}: "
+                f"{bytes(header[0:cnt])!r}"
+            )
 
-        # Init Deinterlace
-        self.numamps_image = self.exposure.image.focalplane.numamps_image
-        self.numpix_amp = self.exposure.image.focalplane.numpix_amp
+        return
 
-        reqCnt = min(
-            data_size - 17, self.RecBufferSize - 17
-        )  # 17 bytes for the data frame size (%16d + space)
-        dataCnt = 0  # receved data counter
-        repCnt = 0  # repeate data request counter: 100
-        getData = b""
-        totalpixels = int(data_size / 2)
-        self.PixelsReadout = 0
-        self.pixels_remaining = totalpixels
+    def connect(self):
+        """
+        Connect the data socket to the controller server if not already connected.
+        Call during integration so connection setup is not part of the readout.
+        Does nothing while image data is being received.
+        """
 
-        # create temporary image buffer
-        BufferTemp = numpy.empty(shape=(self.exposure.image.data.size), dtype="<u2")
+        if self.receiving:
+            return
 
-        # set image data pointer
-        ptrData = 0
+        run_coroutine(self.connect_idle_async())
 
-        # loop over data just read, long repeat as images could be slow to start
-        while (dataCnt < data_size) and (repCnt < 50):
+        return
 
-            # check if aborted by user (from abort() - controller.abort()
-            if (
-                azcam.db.exposure.exposure_flag
-                == azcam.db.exposure.exposureflags["ABORT"]
-            ):
+    async def connect_idle_async(self):
+        """
+        Connect the data socket unless image data is being received.
+        receiving is checked here as a receive may start in the event loop at any time.
+        """
 
-                # if in a sequence then let this readout finish
-                if self.exposure.is_exposure_sequence:
-                    pass  # return will not be an error
-                else:
-                    # break out of read loop
-                    azcam.db.controller.readout_abort()  # stop ControllerServer
-                    break
+        if not self.receiving:
+            await self.connect_async()
 
-            getData = self.request_data(
-                reqCnt + 17
-            )  # request data + 17 bytes for data length
-            len1 = len(getData)
-            azcam.log(f"Readout: {self.pixels_remaining:10d} pixels remaining", level=3)
+        return
 
-            if len1 != 0:
-                dataCnt += len1
-                repCnt = 0
+    async def connect_async(self):
+        """
+        Connect the data socket to the controller server, awaitable version.
+        An existing connection is reused if it passes check_connection().
+        """
 
-                # store data
-                pixelsreadout = int(
-                    len1 / 2
-                )  # number pixels in this read now available
+        if self.check_connection():
+            return
 
-                # convert received data to unsigned shorts
-                ImageBufferTemp = numpy.ndarray(
-                    shape=(1, pixelsreadout), dtype="<u2", buffer=getData
-                )
+        self.close()
+
+        camserver = self.get_camserver()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(
+                asyncio.get_running_loop().sock_connect(
+                    sock, (camserver.host, camserver.port)
+                ),
+                self.connect_timeout,
+            )
+        except BaseException:
+            sock.close()
+            raise
+        self.socket = sock
 
-                # copy the data into TempBuffer
-                BufferTemp[ptrData : ptrData + pixelsreadout] = ImageBufferTemp[
-                    0:pixelsreadout
-                ]
-                ptrData = ptrData + pixelsreadout
+        return
 
-                reqCnt = min(data_size - dataCnt - 17, self.RecBufferSize - 17)
-                self.PixelsReadout = self.PixelsReadout + pixelsreadout
-                self.pixels_remaining = self.pixels_remaining - pixelsreadout
-                # time.sleep(0.2)
-            else:
-                time.sleep(0.2)
-                repCnt = repCnt + 1
-
-        # check if all data has been received
-        if dataCnt == data_size:
-            self.valid = 1
-            self.pixels_remaining = 0
-            azcam.log("Image data received")
-        else:
-            if (
-                not azcam.db.exposure.exposure_flag
-                == azcam.db.exposure.exposureflags["ABORT"]
-            ):
-                s = "ERROR in ReceiveImageData: Received %d of %d bytes" % (
-                    dataCnt,
-                    data_size,
-                )
-                self.socket.close()
-                raise azcam.AzcamError(s)
-            else:
+    def check_connection(self):
+        """
+        Return True if the data socket is connected and idle.
+        A closed connection or unexpected pending data fails the check.
+        """
+
+        if not self.socket:
+            return False
+
+        try:
+            readable, _, errored = select.select([self.socket], [], [self.socket], 0)
+            if readable or errored:
+                return False  # closed by server or stale data
+            return self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        """
+        Close the data socket.
+        """
+
+        if self.socket:
+            try:
                 self.socket.close()
-                raise azcam.AzcamError("Aborted in receive_image_data", error_code=3)
-        self.socket.close()
+            except OSError:
+                pass
+        self.socket = 0
+
+        return
+
+    def get_camserver(self):
+        """
+        Return the camera server interface used for image data.
+        """
+
+        if self.camserver:
+            return self.camserver
+
+        return azcam.db.controller.camserver
+
+    def get_data_order(self):
+        """
+        Return the amplifier data order for this receiver.
+        """
+
+        if self.data_order is None:
+            return self.exposure.data_order
 
-        # deinterlace into exposure.image.data
-        BufferTemp = BufferTemp.reshape(self.numpix_amp, self.numamps_image)
+        return self.data_order
 
-        if len(self.exposure.data_order) == 0:
-            for AmpPos in range(0, self.numamps_image):
-                self.exposure.image.data[AmpPos, 0 : self.numpix_amp] = BufferTemp[
-                    0 : self.numpix_amp, AmpPos
-                ]
+    def readout_abort(self):
+        """
+        Stop the readout on the camera server.
+        """
+
+        if self.camserver:
+            self.camserver.command("AbortReadout")
         else:
-            indx = 0
-            for item in self.exposure.data_order:
-                self.exposure.image.data[indx, 0 : self.numpix_amp] = BufferTemp[
-                    0 : self.numpix_amp, item
-                ]
-                indx += 1
+            azcam.db.controller.readout_abort()
 
         return
 
-    def request_data(self, datacnt):
+    def abort_requested(self):
+        """
+        Return True if the readout has been aborted by the user.
+        Readouts in an exposure sequence are allowed to finish.
+        """
+
+        if self.abort_event is not None:
+            return self.abort_event.is_set()
 
-        request = "GetImageData " + str(datacnt) + "\n"
-        self.socket.send(str.encode(request))
+        return (
+            azcam.db.exposure.exposure_flag == azcam.db.exposure.exposureflags["ABORT"]
+            and not self.exposure.is_exposure_sequence
+        )
+
+    def finish_metrics(self):
+        """
+        Complete metrics for this readout and append them to metrics_file.
+        """
+
+        self.metrics.finish(self.deinterlace_time)
+        self.readout_start_time = 0.0
+
+        m = self.metrics
+        azcam.log(
+            f"Received {m.bytes_received} bytes in {len(m.chunk_bytes)} chunks: "
+            f"{m.mbytes_per_sec:.1f} MB/s, first byte {m.first_byte_time:.3f} s, "
+            f"deinterlace {m.deinterlace_time:.3f} s",
+            level=3,
+        )
+
+        if self.metrics_file:
+            try:
+                self.metrics.write(self.metrics_file)
+            except OSError as e:
+                azcam.log(f"Could not write receive metrics: {e}")
+
+        return
+
+    def get_metrics(self):
+        """
+        Return transfer metrics of the last readout as a dictionary.
+        """
+
+        return self.metrics.get_metrics()
+
+    def get_buffer(self, numpix, dtype="<u2"):
+        """
+        Return a temporary receive buffer of numpix pixels of dtype.
+        If memmap_folder is set the buffer is a file mapping and image.data is also
+        made memory-mapped, so the frame does not need to be resident in memory twice.
+        """
+
+        if not self.memmap_folder:
+            return self.buffer_pool.get(numpix, dtype)
+
+        if (
+            self.memmap_buffer is None
+            or self.memmap_buffer.size != numpix
+            or self.memmap_buffer.dtype != numpy.dtype(dtype)
+        ):
+            self.memmap_buffer = None
+            self.memmap_buffer = self.create_memmap((numpix,), dtype)
+
+        data = self.image.data
+        if not isinstance(data, numpy.memmap):
+            self.image.data = self.create_memmap(data.shape, data.dtype)
+
+        return self.memmap_buffer
+
+    def release_buffer(self, buffer):
+        """
+        Return a temporary receive buffer for reuse.
+        """
+
+        if buffer is not self.memmap_buffer:
+            self.buffer_pool.release(buffer)
+
+        if self.wire_buffer is not None:
+            self.wire_pool.release(self.wire_buffer)
+            self.wire_buffer = None
+
+        return
+
+    def create_memmap(self, shape, dtype="<u2"):
+        """
+        Create a memory-mapped array of dtype pixels in memmap_folder.
+        The backing file is deleted when the array is no longer used.
+        """
+
+        with tempfile.TemporaryFile(dir=self.memmap_folder, prefix="azcam") as f:
+            data = numpy.memmap(f, dtype=dtype, mode="w+", shape=shape)
+
+        return data
+
+    def deinterlace_groups(self, buffer, groups):
+        """
+        Deinterlace buffer into image.data through pixel group number groups.
+        Groups already deinterlaced are skipped.
+        """
+
+        first = self.groups_deinterlaced
+        if groups <= first:
+            return
+
+        start = time.perf_counter()
+        self.deinterlacer.deinterlace(
+            buffer[first * self.numamps_image : groups * self.numamps_image],
+            self.image.data[self.amp_start : self.amp_start + self.numamps_image],
+            self.numamps_image,
+            self.numpix_amp,
+            self.get_data_order(),
+            first,
+        )
+        self.deinterlace_time += time.perf_counter() - start
+        self.groups_deinterlaced = groups
+
+        return
+
+    async def request_data(self, datacnt):
+        """
+        Request image data and return it as bytes.
+        """
+
+        await self.send_data_request(datacnt)
 
         loop = 1
         rptCnt = 10
@@ -179,7 +794,7 @@ class ReceiveData(object):
 
         datacnt += 17
         while (loop == 1) and (rptCnt > 0):
-            oneFrame = self.socket.recv(datacnt)
+            oneFrame = await self._recv(datacnt)
             if len(oneFrame) > 0:
                 dataFrame += oneFrame
                 cntFrame += 1
@@ -202,6 +817,7 @@ class ReceiveData(object):
                     else:
                         datacnt = datacnt - len(dataFrame)
                         rptCnt -= 1
+                        self.metrics.empty_reads += 1
                 else:
                     if dataCnt == len(dataFrame):
                         data = dataFrame
@@ -215,17 +831,189 @@ class ReceiveData(object):
 
         return data
 
-    def mock_data(self):
+    async def request_data_pipelined(self, view, remaining):
+        """
+        Keep up to pipeline_depth GetImageData requests outstanding and receive the next
+        data frame directly into view.
+        remaining is the number of bytes still to be received.
+        Returns the number of data bytes received.
+        """
+
+        # fill the pipeline without requesting more than remains
+        while len(self.requests) < self.pipeline_depth:
+            size = min(self.get_chunk_size(), remaining - sum(self.requests))
+            if size <= 0:
+                break
+            await self.send_data_request(size)
+            self.requests.append(size)
+
+        if len(self.requests) == 0:
+            return 0
+
+        cnt = await self.receive_data_frame_into(view)
+        self.requests.popleft()
+
+        now = time.perf_counter()
+        self.update_chunk_size(cnt, now - self.frame_time)
+        self.frame_time = now
+
+        return cnt
+
+    def get_chunk_size(self):
+        """
+        Return the size of the next data request in bytes.
+        """
+
+        if self.adaptive_chunks:
+            return self.chunk_size
+        else:
+            return self.RecBufferSize
+
+    def update_chunk_size(self, datacnt, elapsed):
+        """
+        Update adaptive data request size from the throughput of the last data frame.
+        datacnt is bytes received in elapsed seconds.
+        """
+
+        if not self.adaptive_chunks or datacnt == 0 or elapsed <= 0:
+            return
+
+        size = int(datacnt / elapsed * self.chunk_time)
+        size = (self.chunk_size + size) // 2  # smooth changes
+        size = min(max(size, self.RecBufferSizeMin), self.RecBufferSizeMax)
+        self.chunk_size = max(4096, size - size % 4096)
+
+        return
+
+    async def send_data_request(self, datacnt):
         """
-        Generate mock data for demo mode.
+        Send a GetImageData request for up to datacnt bytes.
         """
 
-        ix = self.exposure.image.focalplane.numcols_image
-        iy = self.exposure.image.focalplane.numrows_image
+        request = "GetImageData " + str(datacnt) + "\n"
+        await asyncio.get_running_loop().sock_sendall(self.socket, str.encode(request))
+
+        return
+
+    async def receive_data_frame_into(self, view):
+        """
+        Receive one data frame into view, a writable byte memoryview.
+        The 17 byte frame header is read first, then the data bytes are written into view
+        with socket.recv_into so no intermediate bytes objects are created.
+        Returns the number of data bytes received.
+        """
 
-        for AmpPos in range(azcam.db.exposure.image.focalplane.numamps_image):
-            self.exposure.image.data[AmpPos] = numpy.linspace(
-                0, 65355, int(iy * ix / self.image.focalplane.numamps_image)
+        # data frame size (%16d + space)
+        header = bytearray(17)
+        if await self._recv_into(memoryview(header)) < 17:
+            return 0
+
+        dataCnt = int(header[0:16])
+        if dataCnt <= 0:
+            return 0
+        if dataCnt > len(view):
+            raise azcam.AzcamError(
+                f"Image data frame of {dataCnt} bytes exceeds buffer of {len(view)} bytes"
             )
 
+        # data is flowing, wait at most chunk_timeout between socket reads
+        self.deadline = time.perf_counter() + self.chunk_timeout
+
+        return await self._recv_into(view[0:dataCnt], True)
+
+    async def _recv_into(self, view, extend=False):
+        """
+        Fill view from the data socket, waiting for data as it becomes ready.
+        extend True moves the deadline chunk_timeout past each socket read with data.
+        Returns number of bytes received, which is less than len(view) only if the
+        deadline passed, the connection was closed, or the readout was aborted.
+        """
+
+        eventloop = asyncio.get_running_loop()
+
+        gotCnt = 0
+        size = len(view)
+
+        while gotCnt < size:
+            cnt = await self._wait_recv(
+                eventloop.sock_recv_into(self.socket, view[gotCnt:])
+            )
+            if cnt is None:  # deadline passed or aborted
+                break
+
+            if cnt == 0:  # connection closed, no more data will arrive
+                self.metrics.empty_reads += 1
+                self.deadline = 0.0
+                break
+
+            gotCnt += cnt
+            if extend:
+                self.deadline = time.perf_counter() + self.chunk_timeout
+
+        return gotCnt
+
+    async def _recv(self, size):
+        """
+        Receive up to size bytes from the data socket, waiting for data as it becomes ready.
+        Returns b"" if the deadline passed or the readout was aborted.
+        """
+
+        eventloop = asyncio.get_running_loop()
+
+        data = await self._wait_recv(eventloop.sock_recv(self.socket, size))
+        if data is None:  # deadline passed or aborted
+            return b""
+
+        if len(data) == 0:  # connection closed, no more data will arrive
+            self.metrics.empty_reads += 1
+            self.deadline = 0.0
+
+        return data
+
+    async def _wait_recv(self, coro):
+        """
+        Run socket read coro until it completes, checking for abort every abort_check_time.
+        The read stays pending across abort checks, as cancelling a read in progress can
+        lose data (e.g. with the Windows proactor event loop).
+        Returns the read result or None if the deadline passed or the readout was aborted.
+        """
+
+        task = asyncio.ensure_future(coro)
+
+        while True:
+            timeout = min(self.deadline - time.perf_counter(), self.abort_check_time)
+            if timeout <= 0:
+                break
+
+            try:
+                done, pending = await asyncio.wait({task}, timeout=timeout)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+
+            if done:
+                return task.result()
+
+            self.metrics.empty_reads += 1  # received no data
+            if self.abort_requested():
+                break
+
+        # give up, but keep data of a read which completed meanwhile
+        task.cancel()
+        try:
+            return await task
+        except asyncio.CancelledError:
+            return None
+
+    def mock_data(self):
+        """
+        Generate synthetic data for demo mode.
+        """
+
+        self.synthetic_image.make_image(
+            self.image,
+            self.exposure.image_type.lower(),
+            self.exposure.exposure_time,
+        )
+
         return
@@ -0,0 +1,118 @@
+"""
+Contains the ReceiveMetrics class.
+"""
+
+import json
+import time
+
+
+class ReceiveMetrics(object):
+    """
+    Transfer metrics for one image readout.
+    """
+
+    def __init__(self):
+
+        self.reset()
+
+    def reset(self, data_size=0, readout_start_time=0.0):
+        """
+        Reset metrics for a new readout.
+        data_size is bytes to be received.
+        readout_start_time is time.perf_counter() when ReadImage was sent, 0 if unknown.
+        """
+
+        # time of this readout, seconds since epoch
+        self.timestamp = time.time()
+        # bytes expected and received
+        self.data_size = data_size
+        self.bytes_received = 0
+        # bytes and latency (time since previous chunk) of each chunk, seconds
+        self.chunk_bytes = []
+        self.chunk_latency = []
+        # number of empty socket reads
+        self.empty_reads = 0
+        # number of data requests which returned no data
+        self.retries = 0
+        # number of reconnects to continue a stalled transfer
+        self.resumes = 0
+        # time from ReadImage (or receive start) to first data byte, seconds
+        self.first_byte_time = 0.0
+        # time from receive start to last data byte, seconds
+        self.transfer_time = 0.0
+        # transfer rate, MB/s
+        self.mbytes_per_sec = 0.0
+        # deinterlace time, seconds
+        self.deinterlace_time = 0.0
+
+        self.start_time = time.perf_counter()
+        if readout_start_time > 0:
+            self.readout_start_time = readout_start_time
+        else:
+            self.readout_start_time = self.start_time
+        self.first_chunk_time = 0.0
+        self.last_chunk_time = self.start_time
+
+        return
+
+    def add_chunk(self, nbytes):
+        """
+        Record a received chunk of nbytes bytes.
+        """
+
+        now = time.perf_counter()
+
+        if len(self.chunk_bytes) == 0:
+            self.first_chunk_time = now
+            self.first_byte_time = now - self.readout_start_time
+
+        self.chunk_bytes.append(nbytes)
+        self.chunk_latency.append(now - self.last_chunk_time)
+        self.bytes_received += nbytes
+        self.last_chunk_time = now
+
+        return
+
+    def finish(self, deinterlace_time=0.0):
+        """
+        Compute summary values after the transfer.
+        """
+
+        if len(self.chunk_bytes) > 0:
+            self.transfer_time = self.last_chunk_time - self.start_time
+        if self.transfer_time > 0:
+            self.mbytes_per_sec = self.bytes_received / self.transfer_time / 1.0e6
+        self.deinterlace_time = deinterlace_time
+
+        return
+
+    def get_metrics(self):
+        """
+        Return metrics as a dictionary.
+        """
+
+        return {
+            "timestamp": self.timestamp,
+            "data_size": self.data_size,
+            "bytes_received": self.bytes_received,
+            "chunks": len(self.chunk_bytes),
+            "chunk_bytes": self.chunk_bytes,
+            "chunk_latency": self.chunk_latency,
+            "empty_reads": self.empty_reads,
+            "retries": self.retries,
+            "resumes": self.resumes,
+            "first_byte_time": self.first_byte_time,
+            "transfer_time": self.transfer_time,
+            "mbytes_per_sec": self.mbytes_per_sec,
+            "deinterlace_time": self.deinterlace_time,
+        }
+
+    def write(self, filename):
+        """
+        Append metrics to filename as one line of JSON.
+        """
+
+        with open(filename, "a") as f:
+            f.write(json.dumps(self.get_metrics()) + "\n")
+
+        return
@@ -0,0 +1,261 @@
+"""
+Contains the SharedImage class.
+"""
+
+import json
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+import azcam
+
+
+def attach_shared_memory(shared_name):
+    """
+    Open an existing shared memory block without tracking it, so the block is not
+    removed when this process exits. The creating process owns the block.
+    """
+
+    try:
+        return shared_memory.SharedMemory(shared_name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(shared_name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def create_shared_memory(shared_name, size):
+    """
+    Create a shared memory block of size bytes, replacing a block of the same name
+    left over from an earlier process.
+    """
+
+    try:
+        return shared_memory.SharedMemory(shared_name, create=True, size=size)
+    except FileExistsError:
+        old = shared_memory.SharedMemory(shared_name)
+        old.close()
+        old.unlink()
+        return shared_memory.SharedMemory(shared_name, create=True, size=size)
+
+
+def close_shared_memory(shm):
+    """
+    Close and remove a shared memory block created by create_shared_memory().
+    Views still in use keep the memory until they are released.
+    """
+
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+    return
+
+
+def get_amp_geometry(focalplane, numpix_amp):
+    """
+    Return amplifier geometry as (numrows, numcols, datarows, datacols, biascols),
+    where datarows, datacols and biascols are slices of the imaging area and serial
+    overscan of each amplifier. An unknown layout is one row of data pixels per amp.
+    """
+
+    numcols = getattr(focalplane, "numcols_amp", 0)
+    numrows = getattr(focalplane, "numrows_amp", 0)
+
+    if numcols <= 0 or numcols * numrows != numpix_amp:
+        return 1, numpix_amp, slice(0, 1), slice(0, numpix_amp), slice(0, 0)
+
+    xunderscan = getattr(focalplane, "xunderscan", 0)
+    yunderscan = getattr(focalplane, "yunderscan", 0)
+    xoverscan = getattr(focalplane, "numcols_overscan", 0)
+    yoverscan = getattr(focalplane, "numrows_overscan", 0)
+
+    lastcol = max(xunderscan, numcols - xoverscan)
+    datacols = slice(xunderscan, lastcol)
+    datarows = slice(yunderscan, max(yunderscan, numrows - yoverscan))
+    biascols = slice(lastcol, numcols)
+
+    return numrows, numcols, datarows, datacols, biascols
+
+
+class SharedImage(object):
+    """
+    Publishes image data in a shared memory block for display and analysis processes.
+    Image data is received directly into the block, so consumers attach with
+    SharedImage.attach(shared_name) and read the image without copies or disk files.
+    The block starts with a JSON descriptor giving geometry, exposure id and state,
+    followed by the pixel data, shape [numamps_image, numpix_amp].
+    Not for use with ReceiveData.memmap_folder, which also replaces image.data.
+    """
+
+    # bytes reserved for the counter, descriptor length and JSON descriptor
+    DESCRIPTOR_BYTES = 4096
+
+    def __init__(self):
+
+        # True to publish images in shared memory
+        self.enabled = 0
+        # shared memory block name
+        self.shared_name = "azcamimage"
+
+        self.shared_memory = None
+        # [update counter, descriptor length], counter is odd while the descriptor changes
+        self.counter = None
+        # current descriptor
+        self.descriptor = {}
+        # number of images published
+        self.frame = 0
+
+    def publish(self, image, exposure_id=""):
+        """
+        Make image.data a view of the shared memory block and describe it.
+        Call before readout so the image is visible while it is received.
+        """
+
+        data = image.data
+        size = self.DESCRIPTOR_BYTES + data.nbytes
+
+        if self.shared_memory is None or self.shared_memory.size < size:
+            self.allocate(size)
+
+        image.data = numpy.ndarray(
+            shape=data.shape,
+            dtype=data.dtype,
+            buffer=self.shared_memory.buf,
+            offset=self.DESCRIPTOR_BYTES,
+        )
+
+        focalplane = image.focalplane
+        self.frame += 1
+        self.descriptor = {
+            "frame": self.frame,
+            "exposure_id": exposure_id,
+            "state": "readout",
+            "dtype": data.dtype.str,
+            "shape": list(data.shape),
+            "offset": self.DESCRIPTOR_BYTES,
+            "numamps_image": focalplane.numamps_image,
+            "numpix_amp": focalplane.numpix_amp,
+            "numcols_amp": getattr(focalplane, "numcols_amp", 0),
+            "numrows_amp": getattr(focalplane, "numrows_amp", 0),
+            "numcols_image": getattr(focalplane, "numcols_image", 0),
+            "numrows_image": getattr(focalplane, "numrows_image", 0),
+        }
+        self.write_descriptor()
+
+        return
+
+    def set_state(self, state):
+        """
+        Set descriptor state, "readout", "complete" or "aborted".
+        """
+
+        if self.shared_memory is None:
+            return
+
+        self.descriptor["state"] = state
+        self.write_descriptor()
+
+        return
+
+    def allocate(self, size):
+        """
+        Create the shared memory block.
+        """
+
+        self.close()
+
+        self.shared_memory = create_shared_memory(self.shared_name, size)
+
+        self.counter = numpy.ndarray(
+            shape=(2,), dtype="<i8", buffer=self.shared_memory.buf
+        )
+        self.counter[:] = 0
+
+        return
+
+    def write_descriptor(self):
+        """
+        Write descriptor to the shared memory block.
+        """
+
+        text = json.dumps(self.descriptor).encode()
+        if len(text) > self.DESCRIPTOR_BYTES - 16:
+            raise azcam.AzcamError("Shared image descriptor too long")
+
+        self.counter[0] += 1
+        self.shared_memory.buf[16 : 16 + len(text)] = text
+        self.counter[1] = len(text)
+        self.counter[0] += 1
+
+        return
+
+    def close(self):
+        """
+        Release the shared memory block.
+        Images still using it keep a view until their data is replaced.
+        """
+
+        self.counter = None
+
+        if self.shared_memory is not None:
+            close_shared_memory(self.shared_memory)
+            self.shared_memory = None
+
+        return
+
+    @classmethod
+    def read_descriptor(cls, shm, timeout=5.0):
+        """
+        Return the descriptor of an attached shared memory block as a dictionary.
+        Waits up to timeout seconds while the descriptor is being written or before
+        the first image is published.
+        """
+
+        counter = numpy.ndarray(shape=(2,), dtype="<i8", buffer=shm.buf)
+        deadline = time.perf_counter() + timeout
+
+        while True:
+            start = int(counter[0])
+            length = int(counter[1])
+            if start % 2 == 0 and 0 < length <= cls.DESCRIPTOR_BYTES - 16:
+                text = bytes(shm.buf[16 : 16 + length])
+                if int(counter[0]) == start:
+                    break
+
+            if time.perf_counter() > deadline:
+                raise azcam.AzcamError("Shared image descriptor not available")
+            time.sleep(0.001)
+
+        return json.loads(text)
+
+    @classmethod
+    def attach(cls, shared_name="azcamimage", timeout=5.0):
+        """
+        Open an image published by another process.
+        Returns (shared_memory, descriptor, data), where data is a live view of the
+        image data. Check read_descriptor(shared_memory)["state"] for "complete".
+        Close shared_memory when done, but do not unlink it.
+        """
+
+        shm = attach_shared_memory(shared_name)
+        try:
+            descriptor = cls.read_descriptor(shm, timeout)
+        except azcam.AzcamError:
+            shm.close()
+            raise
+
+        data = numpy.ndarray(
+            shape=descriptor["shape"],
+            dtype=descriptor["dtype"],
+            buffer=shm.buf,
+            offset=descriptor["offset"],
+        )
+
+        return shm, descriptor, data
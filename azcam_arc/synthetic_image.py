@@ -0,0 +1,145 @@
+"""
+Contains the SyntheticImage class.
+"""
+
+import numpy
+
+from .shared_image import get_amp_geometry
+
+
+class SyntheticImage(object):
+    """
+    Generates realistic synthetic image data for demo mode.
+    Each amplifier has its own bias level, read noise, an overscan region with bias only,
+    a sky level with gradient, and optional stars.
+    The noise-free frame and a noise field are cached, so each new frame costs one
+    vectorized add of the noise field at a random offset.
+    """
+
+    def __init__(self):
+
+        # bias level of first amplifier, counts
+        self.bias_level = 1000.0
+        # bias level change for each following amplifier, counts
+        self.bias_step = 100.0
+        # read noise, counts
+        self.read_noise = 5.0
+        # sky signal rate, counts/second (not used for zero images)
+        self.sky_rate = 100.0
+        # maximum sky signal, counts
+        self.sky_max = 30000.0
+        # sky signal change across each amplifier as fraction of sky signal
+        self.gradient = 0.1
+        # number of stars per image, 0 for none
+        self.num_stars = 20
+        # peak signal of brightest star, counts
+        self.star_peak = 30000.0
+        # star gaussian sigma, pixels
+        self.star_sigma = 1.5
+        # random number seed
+        self.seed = 0
+
+        # cached noise-free frame and its key
+        self.base = None
+        self.base_key = None
+        # cached noise field, longer than the frame so offsets give different noise
+        self.noise = None
+        self.noise_pad = 8192
+
+        self.rng = numpy.random.default_rng(self.seed)
+
+    def get_geometry(self, focalplane):
+        """
+        Return amplifier geometry as (numamps, numrows, numcols, datacols, datarows),
+        where datacols and datarows are slices of the imaging area of each amplifier.
+        """
+
+        numrows, numcols, datarows, datacols, _ = get_amp_geometry(
+            focalplane, focalplane.numpix_amp
+        )
+
+        return focalplane.numamps_image, numrows, numcols, datacols, datarows
+
+    def make_base(self, geometry, imagetype, exposure_time):
+        """
+        Make the noise-free frame as uint16, shape [numamps, numrows, numcols].
+        """
+
+        numamps, numrows, numcols, datacols, datarows = geometry
+
+        base = numpy.empty(shape=[numamps, numrows, numcols], dtype="float32")
+
+        # bias for each amplifier
+        bias = self.bias_level + self.bias_step * numpy.arange(numamps, dtype="float32")
+        base[:] = bias[:, None, None]
+
+        # sky with gradient in imaging area only
+        if imagetype != "zero":
+            sky = min(self.sky_rate * exposure_time, self.sky_max)
+            data = base[:, datarows, datacols]
+            nr, nc = data.shape[1:]
+            x = numpy.linspace(0.0, 1.0, max(nc, 1), dtype="float32")
+            y = numpy.linspace(0.0, 1.0, max(nr, 1), dtype="float32")
+            ramp = (x[None, :] + y[:, None]) * (0.5 * self.gradient * sky)
+            data += sky + ramp[None, :, :]
+
+            # stars in imaging area
+            if self.num_stars > 0 and sky > 0 and nr > 1 and nc > 1:
+                rng = numpy.random.default_rng(self.seed)
+                size = int(4 * self.star_sigma) + 1
+                offsets = numpy.arange(-size, size + 1, dtype="float32")
+                psf = numpy.exp(
+                    -(offsets[:, None] ** 2 + offsets[None, :] ** 2)
+                    / (2 * self.star_sigma**2)
+                )
+                for _ in range(self.num_stars):
+                    amp = rng.integers(numamps)
+                    row = rng.integers(nr)
+                    col = rng.integers(nc)
+                    peak = self.star_peak * rng.power(0.3)
+                    r0, r1 = max(0, row - size), min(nr, row + size + 1)
+                    c0, c1 = max(0, col - size), min(nc, col + size + 1)
+                    data[amp, r0:r1, c0:c1] += (
+                        peak
+                        * psf[
+                            r0 - row + size : r1 - row + size,
+                            c0 - col + size : c1 - col + size,
+                        ]
+                    )
+
+        # leave room for noise so adding it in make_image() cannot wrap around
+        limit = 8 * self.read_noise
+        numpy.clip(base, limit, 65535 - limit, out=base)
+
+        return base.astype("<u2")
+
+    def make_image(self, image, imagetype="object", exposure_time=1.0):
+        """
+        Write a synthetic frame into image.data, shape [numamps, numpix_amp].
+        """
+
+        geometry = self.get_geometry(image.focalplane)
+        numpix = image.data.size
+
+        key = (geometry, imagetype, exposure_time)
+        if key != self.base_key:
+            self.base = self.make_base(geometry, imagetype, exposure_time).reshape(-1)
+            self.base_key = key
+
+        if self.noise is None or self.noise.size != numpix + self.noise_pad:
+            rng = numpy.random.default_rng(self.seed)
+            noise = rng.standard_normal(numpix + self.noise_pad, dtype="float32")
+            noise *= self.read_noise
+            numpy.clip(noise, -8 * self.read_noise, 8 * self.read_noise, out=noise)
+            self.noise = noise.round().astype("int16")
+
+        # new noise each frame from a random offset into the cached field
+        offset = self.rng.integers(self.noise_pad)
+        numpy.add(
+            self.base,
+            self.noise[offset : offset + numpix],
+            out=image.data.reshape(-1),
+            casting="unsafe",
+        )
+
+        return
@@ -0,0 +1,304 @@
+"""
+Readout benchmark for ReceiveData.receive_image_data.
+
+Image data is received from a local CameraServerSimulator while sweeping frame size,
+number of amplifiers, data order and RecBufferSize. Each case runs in its own process
+so peak RSS is measured per case, and the simulator runs in another process so its
+frame data is not included. Results are written as JSON, for example:
+
+    python -m azcam_arc.tests.benchmark_readout --sizes 1024 4096 --amps 1 16 \
+        --option zero_copy=1 --output readout.json
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import platform
+import queue as queue_module
+import time
+import types
+
+import numpy
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FRAME_SIZES = [1024, 2048, 4096, 8192, 10240]
+NUMAMPS = [1, 2, 4, 8, 16, 32]
+DATA_ORDERS = ["none", "reversed", "shuffled"]
+BUFFER_SIZES = [1024 * 1024, 5 * 1024 * 1024, 20 * 1024 * 1024]
+
+
+def make_data_order(order, numamps):
+    """
+    Return a data_order list for a named order.
+    """
+
+    if order == "none":
+        return []
+    elif order == "reversed":
+        return list(range(numamps))[::-1]
+    elif order == "shuffled":
+        return [int(x) for x in numpy.random.default_rng(numamps).permutation(numamps)]
+    else:
+        raise ValueError(f"Unknown data order {order}")
+
+
+def image_digests(rows):
+    """
+    Return a list of SHA-1 digests, one for each row of image data.
+    """
+
+    return [hashlib.sha1(numpy.ascontiguousarray(row)).hexdigest() for row in rows]
+
+
+def _run_simulator_process(settings, connection):
+    """
+    Run a simulator for one case and send back digests of the image data it sent.
+    """
+
+    from azcam_arc.camserver_sim import CameraServerSimulator
+
+    sim = CameraServerSimulator()
+    for attr, value in settings.items():
+        setattr(sim, attr, value)
+    connection.send(sim.start())
+
+    # expected image rows for the receiver's amplifiers and data order
+    numamps, numpix_amp, data_order = connection.recv()
+    sent = sim.image_data.reshape(numpix_amp, numamps).T
+    if data_order:
+        sent = sent[data_order]
+    connection.send(image_digests(sent))
+
+    sim.stop()
+
+
+def run_case(case):
+    """
+    Receive one image and return a dictionary of results.
+    """
+
+    import azcam
+
+    from azcam_arc.camera_server import CameraServerInterface
+    from azcam_arc.receive_data import ReceiveData
+
+    size = case["size"]
+    numamps = case["numamps"]
+    numpix_image = size * size
+    numpix_amp = numpix_image // numamps
+    data_order = make_data_order(case["data_order"], numamps)
+
+    # simulator in its own process so its frame data is not in this peak RSS
+    context = multiprocessing.get_context("spawn")
+    connection, child_connection = context.Pipe()
+    simulator = context.Process(
+        target=_run_simulator_process, args=(case["simulator"], child_connection)
+    )
+    simulator.start()
+
+    try:
+        if not connection.poll(30.0):
+            raise RuntimeError("Simulator did not start")
+        port = connection.recv()
+
+        camserver = CameraServerInterface()
+        camserver.set_server("localhost", port)
+
+        # minimal controller and exposure tools for ReceiveData
+        focalplane = types.SimpleNamespace(
+            numamps_image=numamps,
+            numpix_amp=numpix_amp,
+            numpix_image=numpix_image,
+            numcols_image=size,
+            numrows_image=size,
+        )
+        image = types.SimpleNamespace(
+            focalplane=focalplane,
+            data=numpy.empty(shape=[numamps, numpix_amp], dtype="<u2"),
+        )
+        exposure = types.SimpleNamespace(
+            image=image,
+            data_order=data_order,
+            is_exposure_sequence=0,
+            exposure_flag=0,
+            exposureflags={"ABORT": -1},
+        )
+        controller = types.SimpleNamespace(
+            camserver=camserver,
+            readout_abort=lambda: camserver.command("AbortReadout"),
+        )
+        azcam.db.exposure = exposure
+        azcam.db.controller = controller
+
+        receive_data = ReceiveData(exposure)
+        receive_data.RecBufferSize = case["buffer_size"]
+        for attr, value in case["options"].items():
+            setattr(receive_data, attr, value)
+
+        camserver.set("NumberPixelsImage", numpix_image)
+        camserver.command("ReadImage")
+        receive_data.readout_start_time = time.perf_counter()
+
+        start = time.perf_counter()
+        receive_data.receive_image_data(numpix_image * 2)
+        elapsed = time.perf_counter() - start
+
+        # check deinterlaced data against what the simulator sent
+        connection.send((numamps, numpix_amp, data_order))
+        if not connection.poll(60.0):
+            raise RuntimeError("Simulator did not return image digests")
+        valid = connection.recv() == image_digests(image.data[:numamps])
+
+        receive_data.close()
+        simulator.join(10.0)
+    finally:
+        if simulator.is_alive():
+            simulator.terminate()
+
+    metrics = receive_data.get_metrics()
+    result = dict(case)
+    result.update(
+        {
+            "valid": valid,
+            "receive_time": elapsed,
+            "mbytes_per_sec": numpix_image * 2 / elapsed / 1.0e6,
+            "deinterlace_time": metrics["deinterlace_time"],
+            "first_byte_time": metrics["first_byte_time"],
+            "chunks": metrics["chunks"],
+            "retries": metrics["retries"],
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    )
+
+    return result
+
+
+def peak_rss_mb():
+    """
+    Return peak resident memory of this process in MB, 0 where not available.
+    """
+
+    if resource is None:
+        return 0.0
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+        return maxrss / 1.0e6  # bytes
+    else:
+        return maxrss / 1.0e3  # kilobytes
+
+
+def _run_case_process(case, queue):
+    try:
+        queue.put(run_case(case))
+    except Exception as e:
+        result = dict(case)
+        result.update({"valid": False, "error": repr(e)})
+        queue.put(result)
+
+
+def run_case_isolated(case):
+    """
+    Run a case in a new process so peak RSS is for that case only.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_case_process, args=(case, queue))
+    process.start()
+
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1.0)
+        except queue_module.Empty:
+            if not process.is_alive():  # crashed without a result
+                result = dict(case)
+                result.update({"valid": False, "error": "process failed"})
+    process.join()
+
+    return result
+
+
+def parse_value(value):
+    """
+    Convert a command line option value to int, float, or str.
+    """
+
+    for convert in [int, float]:
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReceiveData readout benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=FRAME_SIZES)
+    parser.add_argument("--amps", type=int, nargs="+", default=NUMAMPS)
+    parser.add_argument("--orders", nargs="+", default=DATA_ORDERS)
+    parser.add_argument("--buffers", type=int, nargs="+", default=BUFFER_SIZES)
+    parser.add_argument(
+        "--option",
+        nargs="+",
+        default=[],
+        help="ReceiveData attributes, for example zero_copy=1 pipeline_depth=4",
+    )
+    parser.add_argument(
+        "--simulator",
+        nargs="+",
+        default=[],
+        help="simulator attributes, for example pixel_rate=5e6 max_chunk=1048576",
+    )
+    parser.add_argument("--output", default="benchmark_readout.json")
+    args = parser.parse_args()
+
+    options = {k: parse_value(v) for k, v in (x.split("=") for x in args.option)}
+    simulator = {k: parse_value(v) for k, v in (x.split("=") for x in args.simulator)}
+
+    results = []
+    for size in args.sizes:
+        for numamps in args.amps:
+            for data_order in args.orders:
+                for buffer_size in args.buffers:
+                    case = {
+                        "size": size,
+                        "numamps": numamps,
+                        "data_order": data_order,
+                        "buffer_size": buffer_size,
+                        "options": options,
+                        "simulator": simulator,
+                    }
+                    result = run_case_isolated(case)
+                    results.append(result)
+                    print(
+                        f"{size:6d}^2 {numamps:3d} amps {data_order:>9s} "
+                        f"{buffer_size // 1024:6d} kB: "
+                        f"{result.get('mbytes_per_sec', 0):8.1f} MB/s "
+                        f"deinterlace {result.get('deinterlace_time', 0):6.3f} s "
+                        f"RSS {result.get('peak_rss_mb', 0):8.1f} MB "
+                        f"{'ok' if result['valid'] else 'FAILED'}"
+                    )
+
+    output = {
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
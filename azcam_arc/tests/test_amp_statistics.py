@@ -0,0 +1,84 @@
+"""
+Tests of the AmpStatistics class.
+"""
+
+import types
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.amp_statistics import AmpStatistics
+
+NUMAMPS = 3
+NUMROWS = 40
+NUMCOLS = 50
+DATA_ORDER = [2, 0, 1]
+
+
+def make_stream(dtype="<u2"):
+    """
+    Return focalplane, data stream and the image it deinterlaces into.
+    """
+
+    focalplane = types.SimpleNamespace(
+        numcols_amp=NUMCOLS,
+        numrows_amp=NUMROWS,
+        xunderscan=2,
+        yunderscan=1,
+        numcols_overscan=8,
+        numrows_overscan=3,
+    )
+    rng = numpy.random.default_rng(1)
+    stream = rng.integers(0, 5000, NUMAMPS * NUMROWS * NUMCOLS).astype(dtype)
+    stream[::97] = 65535  # some saturated pixels
+    image = stream.reshape(-1, NUMAMPS).T[DATA_ORDER]
+
+    return focalplane, stream, image.reshape(NUMAMPS, NUMROWS, NUMCOLS)
+
+
+def accumulate(statistics, focalplane, stream, steps):
+    """
+    Update statistics in steps pieces, as data arrives during readout.
+    """
+
+    numpix_amp = NUMROWS * NUMCOLS
+    statistics.start(focalplane, NUMAMPS, numpix_amp, DATA_ORDER)
+    for groups in numpy.linspace(0, numpix_amp, steps + 1).astype(int)[1:]:
+        statistics.update(stream, groups)
+
+    return statistics.get_statistics()
+
+
+@pytest.mark.parametrize(
+    "steps, dtype", [(1, "<u2"), (7, "<u2"), (3, "<u4"), (3, "<f4")]
+)
+def test_statistics(steps, dtype):
+    focalplane, stream, image = make_stream(dtype)
+    statistics = AmpStatistics()
+
+    values = accumulate(statistics, focalplane, stream, steps)
+
+    data = image[:, 1:37, 2:42].reshape(NUMAMPS, -1)
+    bias = image[:, :, 42:].reshape(NUMAMPS, -1)
+    binwidth = 1 << statistics.hist_shift
+    assert values["numpix"] == [data.shape[1]] * NUMAMPS
+    assert numpy.allclose(values["mean"], data.mean(axis=1))
+    assert numpy.allclose(values["bias"], bias.mean(axis=1))
+    assert values["saturated"] == list((data >= 65535).sum(axis=1))
+    median = numpy.median(data, axis=1)
+    assert (numpy.abs(numpy.array(values["median"]) - median) <= binwidth).all()
+
+
+def test_unknown_layout():
+    statistics = AmpStatistics()
+    stream = numpy.arange(2 * 100, dtype="<u2")
+
+    statistics.start(types.SimpleNamespace(), 2, 100)
+    statistics.update(stream, 100)
+    values = statistics.get_statistics()
+
+    assert values["numpix"] == [100, 100]
+    assert values["mean"] == [99.0, 100.0]
+    assert values["bias"] == [0.0, 0.0]
@@ -0,0 +1,56 @@
+"""
+Tests of the BufferPool class.
+"""
+
+import numpy
+
+from azcam_arc.buffer_pool import BufferPool
+
+
+def test_reuse():
+    pool = BufferPool()
+
+    buffer = pool.get(1000, "<u2")
+    assert buffer.size == 1000
+    assert buffer.dtype == numpy.dtype("<u2")
+
+    pool.release(buffer)
+    assert pool.get(1000, "<u2") is buffer
+    assert pool.get_counters() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_eviction():
+    pool = BufferPool()
+    pool.release(pool.get(1000))
+    pool.release(pool.get(1000))
+
+    # a new geometry evicts the pooled buffer
+    buffer = pool.get(2000)
+    assert buffer.size == 2000
+    assert pool.get_counters() == {"hits": 1, "misses": 2, "evictions": 1}
+
+    # and a new dtype does too
+    pool.release(buffer)
+    assert pool.get(2000, "<u4").dtype == numpy.dtype("<u4")
+    assert pool.get_counters()["evictions"] == 2
+
+
+def test_release_other_geometry():
+    pool = BufferPool()
+    old = pool.get(1000)
+    pool.get(2000)
+
+    # buffers of an old geometry are dropped, not pooled
+    pool.release(old)
+    assert pool.buffers == []
+
+
+def test_clear():
+    pool = BufferPool()
+    pool.release(pool.get(1000))
+
+    pool.clear()
+
+    assert pool.buffers == []
+    assert pool.key is None
+    assert pool.get_counters()["evictions"] == 1
@@ -0,0 +1,443 @@
+"""
+Tests of camera server commands and image data transfer against CameraServerSimulator.
+
+    python -m pytest azcam_arc/tests
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import types
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.camera_server import CameraServerInterface
+from azcam_arc.camserver_sim import CameraServerSimulator
+from azcam_arc.pixel_format import PixelFormat
+from azcam_arc.receive_data import ReceiveData, run_coroutine
+
+NUMAMPS = 4
+NUMROWS = 101
+NUMCOLS = 103
+DATA_ORDER = [2, 3, 0, 1]
+
+
+def make_exposure(numamps, numpix_amp, data_order):
+    """
+    Return a minimal exposure with an image of numamps by numpix_amp pixels.
+    """
+
+    focalplane = types.SimpleNamespace(
+        numamps_image=numamps,
+        numpix_amp=numpix_amp,
+        numpix_image=numamps * numpix_amp,
+        numcols_amp=NUMCOLS,
+        numrows_amp=numpix_amp // NUMCOLS,
+    )
+    image = types.SimpleNamespace(
+        focalplane=focalplane, data=numpy.zeros((numamps, numpix_amp), dtype="<u2")
+    )
+
+    return types.SimpleNamespace(
+        image=image,
+        data_order=data_order,
+        is_exposure_sequence=0,
+        exposure_flag=0,
+        exposureflags={"ABORT": -1},
+    )
+
+
+def expected_image(sim, numamps, data_order, shift=0):
+    """
+    Return the image rows the simulator data should be deinterlaced into.
+    """
+
+    rows = (sim.image_data.astype("int64") >> shift).reshape(-1, numamps).T
+    if data_order:
+        rows = rows[data_order]
+
+    return rows
+
+
+@pytest.fixture
+def sim():
+    simulator = CameraServerSimulator()
+    simulator.start()
+    simulator.max_chunk = 50000
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def camserver(sim):
+    server = CameraServerInterface()
+    server.set_server("localhost", sim.port)
+    yield server
+    server.socketserver.close()
+
+
+@pytest.fixture
+def exposure(camserver, monkeypatch):
+    exposure = make_exposure(NUMAMPS, NUMROWS * NUMCOLS, DATA_ORDER)
+    controller = types.SimpleNamespace(
+        camserver=camserver,
+        readout_abort=lambda: camserver.command("AbortReadout"),
+    )
+    monkeypatch.setattr(azcam.db, "exposure", exposure, raising=False)
+    monkeypatch.setattr(azcam.db, "controller", controller, raising=False)
+
+    return exposure
+
+
+def read_image(sim, camserver, receive_data):
+    """
+    Read out one image through the simulator into the exposure image.
+    """
+
+    image = receive_data.exposure.image
+    numpix = image.focalplane.numpix_image
+
+    camserver.set("NumberPixelsImage", numpix)
+    camserver.command("ReadImage")
+    receive_data.receive_image_data(receive_data.get_data_size(numpix))
+    receive_data.close()
+
+    return image.data
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"zero_copy": 1}, {"pipeline_depth": 4, "streaming_deinterlace": 1}],
+)
+def test_receive_image(sim, camserver, exposure, options):
+    receive_data = ReceiveData(exposure)
+    for attr, value in options.items():
+        setattr(receive_data, attr, value)
+
+    data = read_image(sim, camserver, receive_data)
+
+    assert (data == expected_image(sim, NUMAMPS, DATA_ORDER)).all()
+
+
+@pytest.mark.parametrize(
+    "name, shift, dtype, options",
+    [
+        ("u16", 2, "", {}),
+        ("p18", 0, "<u4", {}),
+        ("p20", 4, "<u2", {"streaming_deinterlace": 1}),
+        ("p24", 0, "<u4", {"pipeline_depth": 3}),
+        ("u32", 0, "<u4", {}),
+    ],
+)
+def test_pixel_formats(sim, camserver, exposure, name, shift, dtype, options):
+    sim.pixel_format = PixelFormat(name)
+
+    receive_data = ReceiveData(exposure)
+    receive_data.pixel_format = PixelFormat(name, shift)
+    receive_data.image_dtype = dtype
+    for attr, value in options.items():
+        setattr(receive_data, attr, value)
+
+    data = read_image(sim, camserver, receive_data)
+
+    expected = expected_image(sim, NUMAMPS, DATA_ORDER, shift)
+    if data.dtype.itemsize == 2:
+        expected = numpy.minimum(expected, 0xFFFF)
+    assert data.dtype == numpy.dtype(dtype or "<u2")
+    assert (data == expected).all()
+
+
+@pytest.mark.parametrize("options", [{}, {"zero_copy": 1}, {"pipeline_depth": 4}])
+def test_resume(sim, camserver, exposure, options):
+    receive_data = ReceiveData(exposure)
+    receive_data.resume_transfer = 1
+    receive_data.resume_delay = 0.01
+    for attr, value in options.items():
+        setattr(receive_data, attr, value)
+    sim.disconnect_at = 33333
+
+    data = read_image(sim, camserver, receive_data)
+
+    assert receive_data.get_metrics()["resumes"] == 1
+    assert (data == expected_image(sim, NUMAMPS, DATA_ORDER)).all()
+
+
+def test_resume_not_confirmed(sim, camserver, exposure):
+    receive_data = ReceiveData(exposure)
+    receive_data.resume_transfer = 1
+    receive_data.resume_delay = 0.01
+    sim.resume_protocol = 0
+    sim.disconnect_at = 33333
+
+    with pytest.raises(azcam.AzcamError, match="did not resume"):
+        read_image(sim, camserver, receive_data)
+
+    assert receive_data.receiving == 0
+
+
+@pytest.mark.parametrize("options", [{}, {"pipeline_depth": 4}])
+def test_memmap(sim, camserver, exposure, tmp_path, options):
+    receive_data = ReceiveData(exposure)
+    receive_data.memmap_folder = str(tmp_path)
+    for attr, value in options.items():
+        setattr(receive_data, attr, value)
+
+    data = read_image(sim, camserver, receive_data)
+
+    assert isinstance(data, numpy.memmap)
+    assert (data == expected_image(sim, NUMAMPS, DATA_ORDER)).all()
+
+    # the receive buffer is kept for the next readout of the same size
+    buffer = receive_data.memmap_buffer
+    assert isinstance(buffer, numpy.memmap)
+    assert receive_data.get_buffer(buffer.size) is buffer
+    assert receive_data.get_buffer(buffer.size // 2) is not buffer
+
+
+def test_recv_across_abort_checks(exposure):
+    receive_data = ReceiveData(exposure)
+    receive_data.abort_check_time = 0.01
+    receive_data.socket, sender = socket.socketpair()
+    receive_data.socket.setblocking(False)
+    data = bytes(range(256)) * 40
+
+    def send():
+        for start in range(0, len(data), 1000):
+            time.sleep(0.05)  # several abort checks per chunk
+            sender.sendall(data[start : start + 1000])
+
+    async def receive(view):
+        receive_data.deadline = time.perf_counter() + 5.0
+        return await receive_data._recv_into(view, True)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    try:
+        view = memoryview(bytearray(len(data)))
+        assert run_coroutine(receive(view)) == len(data)
+        assert view.tobytes() == data
+        assert receive_data.metrics.empty_reads > 0
+
+        # abort gives up on the read
+        exposure.exposure_flag = exposure.exposureflags["ABORT"]
+        assert run_coroutine(receive(view)) == 0
+    finally:
+        thread.join()
+        sender.close()
+        receive_data.close()
+
+
+def test_batch(sim, camserver):
+    camserver.begin_batch()
+    assert camserver.set("ExposureTime", 1000) is None
+    camserver.set("NumberPixelsImage", 4096)
+    camserver.end_batch()
+
+    assert sim.parameters["ExposureTime"] == "1000"
+    assert sim.parameters["NumberPixelsImage"] == "4096"
+
+    replies = camserver.command_batch(["Get ExposureTime", "Get NumberPixelsImage"])
+    assert replies == [["OK", "1000"], ["OK", "4096"]]
+
+
+def test_batch_error(sim, camserver):
+    camserver.begin_batch()
+    camserver.queue("Set ExposureTime 5")
+    camserver.queue("Bogus")
+    camserver.queue("Set NumberPixelsImage 8")
+
+    with pytest.raises(azcam.AzcamError, match="Bogus"):
+        camserver.end_batch()
+
+    # commands after the error are still sent and the connection stays usable
+    assert sim.parameters["NumberPixelsImage"] == "8"
+    assert camserver.batch == []
+    assert camserver.get("ExposureTime") == ["OK", "5"]
+
+
+def test_cache(sim, camserver):
+    def count(command):
+        return sim.commands.count(command)
+
+    camserver.set("ExposureTime", 1000)
+    assert camserver.get("ExposureTime") == ["OK", "1000"]
+    assert count("Get ExposureTime") == 0
+
+    # read once, then from the cache until the time to live has passed
+    camserver.invalidate_cache()
+    camserver.cache_policy["ExposureTime"] = 0.2
+    camserver.get("ExposureTime")
+    camserver.get("ExposureTime")
+    assert count("Get ExposureTime") == 1
+    time.sleep(0.3)
+    camserver.get("ExposureTime")
+    assert count("Get ExposureTime") == 2
+
+    # parameters not in cache_policy are always read
+    camserver.get("PixelCount")
+    camserver.get("PixelCount")
+    assert count("Get PixelCount") == 2
+
+    # a failed Set removes the cached value
+    assert camserver.set("ExposureTime", "1 2")[0] == "ERROR"
+    assert camserver.get_cached("ExposureTime") is None
+
+
+def test_cache_batch_error(sim, camserver):
+    camserver.get("ExposureTime")
+    camserver.begin_batch()
+    camserver.set("ExposureTime", 5)
+    camserver.queue("Bogus")
+
+    with pytest.raises(azcam.AzcamError, match="Bogus"):
+        camserver.end_batch()
+
+    assert camserver.cache == {}
+
+
+def test_command_stats(sim, camserver):
+    assert camserver.get_command_stats() == {}
+
+    camserver.enable_command_stats()
+    camserver.set("ExposureTime", 1000)
+    camserver.command("ReadImage")
+    camserver.command("ReadImage")
+
+    stats = camserver.get_command_stats()
+    assert stats["Set ExposureTime"]["count"] == 1
+    assert stats["ReadImage"]["count"] == 2
+
+    camserver.enable_command_stats(False)
+    assert camserver.get_command_stats() == {}
+
+
+def test_channels(sim, camserver):
+    camserver.use_channels = 1
+    camserver.open_channels()
+    assert set(camserver.channels) == {"status", "control"}
+    assert all(channel.connected for channel in camserver.channels.values())
+
+    # status and control commands do not wait for a command on the main connection
+    replies = []
+    with camserver.socketserver.lock:
+        thread = threading.Thread(
+            target=lambda: replies.extend(
+                [camserver.get("PixelCount"), camserver.command("AbortExposure")]
+            )
+        )
+        thread.start()
+        thread.join(5.0)
+        assert not thread.is_alive()
+    assert [reply[0] for reply in replies] == ["OK", "OK"]
+
+    camserver.close_channels()
+    assert camserver.channels == {}
+    assert camserver.get("PixelCount")[0] == "OK"
+    camserver.close_channels()
+
+
+def board_command(camserver, name, board, *args):
+    cmdnum = (ord(name[0]) << 16) + (ord(name[1]) << 8) + ord(name[2])
+
+    return camserver.board_command(cmdnum, board, *args)
+
+
+@pytest.mark.parametrize("binary", [0, 1])
+def test_board_commands(sim, camserver, binary):
+    sim.binary_protocol = binary
+    camserver.binary_protocol = 1
+
+    assert board_command(camserver, "WRM", 2, 0x400010, 1234)[0] == "OK"
+    reply = board_command(camserver, "RDM", 2, 0x400010)
+
+    assert camserver.protocol_binary == binary
+    assert int(reply[1]) == 1234
+
+
+def test_binary_non_integer_arguments(sim, camserver):
+    camserver.binary_protocol = 1
+    board_command(camserver, "RDM", 2, 0x400010)
+    assert camserver.protocol_binary == 1
+    socket = camserver.socketserver.socket
+
+    # SBN Type is a word, sent as a text command on the same connection
+    reply = board_command(camserver, "SBN", 2, 1, "VID", 3, 100)
+
+    assert reply[0] == "OK"
+    assert sim.commands[-1].endswith(" 2 1 VID 3 100")
+    assert camserver.socketserver.socket is socket
+    assert board_command(camserver, "TDL", 2, 77) == ["OK", 77]
+
+
+def test_mosaic_receive(monkeypatch):
+    from azcam_arc.exposure_arc import ExposureArc
+
+    numamps = [2, 2]
+    data_order = [1, 0, 2, 3]
+    numpix_amp = NUMROWS * NUMCOLS
+
+    exposure = make_exposure(sum(numamps), numpix_amp, data_order)
+    monkeypatch.setattr(azcam.db, "exposure", exposure, raising=False)
+
+    sims = []
+    receivers = []
+    amp_start = 0
+    try:
+        for amps in numamps:
+            sim = CameraServerSimulator()
+            sim.start()
+            sims.append(sim)
+
+            camserver = CameraServerInterface()
+            camserver.set_server("localhost", sim.port)
+            camserver.set("NumberPixelsImage", amps * numpix_amp)
+            camserver.command("ReadImage")
+
+            receiver = ReceiveData(exposure)
+            receiver.camserver = camserver
+            receiver.amp_start = amp_start
+            receiver.numamps = amps
+            receiver.data_order = ExposureArc.get_mosaic_data_order(
+                exposure, amp_start, amps
+            )
+            receivers.append(receiver)
+            amp_start += amps
+
+        async def receive():
+            await asyncio.gather(
+                *[
+                    receiver.receive_image_data_async(
+                        receiver.get_data_size(receiver.numamps * numpix_amp)
+                    )
+                    for receiver in receivers
+                ]
+            )
+
+        run_coroutine(receive())
+    finally:
+        for receiver in receivers:
+            receiver.close()
+            receiver.camserver.socketserver.close()
+        for sim in sims:
+            sim.stop()
+
+    data = exposure.image.data
+    assert (data[0:2] == expected_image(sims[0], 2, [1, 0])).all()
+    assert (data[2:4] == expected_image(sims[1], 2, [])).all()
+
+
+def test_mosaic_data_order():
+    from azcam_arc.exposure_arc import ExposureArc
+
+    exposure = types.SimpleNamespace(data_order=[3, 2, 1, 0, 5, 4])
+
+    assert ExposureArc.get_mosaic_data_order(exposure, 0, 4) == [3, 2, 1, 0]
+    assert ExposureArc.get_mosaic_data_order(exposure, 4, 2) == [1, 0]
+
+    exposure.data_order = [4, 2, 1, 0, 3, 5]
+    with pytest.raises(azcam.AzcamError):
+        ExposureArc.get_mosaic_data_order(exposure, 0, 4)
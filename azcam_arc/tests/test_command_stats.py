@@ -0,0 +1,89 @@
+"""
+Tests of the CommandStats class.
+"""
+
+import json
+
+import pytest
+
+from azcam_arc.command_stats import CommandStats
+
+
+@pytest.mark.parametrize(
+    "command, verb",
+    [
+        ("", ""),
+        ("ReadImage", "ReadImage"),
+        ("Get PixelCount", "Get PixelCount"),
+        ("Set ExposureTime 1000", "Set ExposureTime"),
+        ("cmd LoadFile 2 tim.lod", "cmd LoadFile"),
+        (
+            f"BoardCommand {(ord('W') << 16) + (ord('R') << 8) + ord('M')} 2",
+            "BoardCommand WRM",
+        ),
+        ("BoardCommand XYZ 2", "BoardCommand"),
+        ("StartExposure now", "StartExposure"),
+    ],
+)
+def test_get_verb(command, verb):
+    assert CommandStats.get_verb(command) == verb
+
+
+def test_stats():
+    stats = CommandStats()
+    for latency in [0.001] * 19 + [0.1]:
+        stats.record("Get PixelCount", latency)
+    stats.record("ReadImage", 0.002)
+
+    values = stats.get_stats()
+    pixelcount = values["Get PixelCount"]
+    assert pixelcount["count"] == 20
+    assert pixelcount["mean"] == pytest.approx((19 * 0.001 + 0.1) / 20)
+    assert pixelcount["min"] == 0.001
+    assert pixelcount["max"] == 0.1
+    assert sum(pixelcount["histogram"]) == 20
+
+    # percentiles are histogram bin upper edges
+    assert 0.001 <= pixelcount["p50"] < 0.002
+    assert 0.001 <= pixelcount["p95"] < 0.002
+    assert values["ReadImage"]["p95"] >= 0.002
+
+    # latencies beyond the last bin
+    stats.record("ReadImage", 100.0)
+    assert stats.get_stats()["ReadImage"]["p95"] == float("inf")
+
+
+def test_ring():
+    stats = CommandStats(ring_size=3)
+    for number in range(5):
+        stats.record(f"Set Value{number} 1", 0.001)
+
+    assert [sample[1] for sample in stats.get_samples()] == [
+        "Set Value2",
+        "Set Value3",
+        "Set Value4",
+    ]
+
+    stats.reset()
+    assert stats.get_samples() == []
+    assert stats.get_stats() == {}
+
+
+def test_dump_and_report(tmp_path):
+    filename = tmp_path / "stats.jsonl"
+    stats = CommandStats()
+    stats.record("ReadImage", 0.5)
+    stats.record("Get PixelCount", 0.001)
+
+    stats.dump(filename)
+    stats.dump(filename, samples=True)
+
+    lines = [json.loads(line) for line in filename.read_text().splitlines()]
+    assert lines[0]["verbs"]["ReadImage"]["count"] == 1
+    assert "samples" not in lines[0]
+    assert len(lines[1]["samples"]) == 2
+
+    # sorted by total time
+    report = stats.report().splitlines()
+    assert report[1].startswith("ReadImage")
+    assert report[2].startswith("Get PixelCount")
@@ -0,0 +1,65 @@
+"""
+Tests of the Deinterlacer class.
+"""
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.deinterlace import Deinterlacer
+
+
+def reference(buffer, numamps, data_order):
+    """
+    Deinterlace one pixel at a time, the way the original receive loop did.
+    """
+
+    numpix_amp = buffer.size // numamps
+    data = numpy.zeros((numamps, numpix_amp), dtype=buffer.dtype)
+    order = data_order or list(range(numamps))
+    for pixel in range(numpix_amp):
+        for amp in range(numamps):
+            data[amp, pixel] = buffer[pixel * numamps + order[amp]]
+
+    return data
+
+
+@pytest.mark.parametrize("data_order", [[], [3, 2, 1, 0], [1, 3, 0, 2]])
+def test_deinterlace(data_order):
+    buffer = numpy.arange(4 * 1001, dtype="<u2")
+    data = numpy.zeros((4, 1001), dtype="<u2")
+
+    deinterlacer = Deinterlacer()
+    deinterlacer.block_size = 64  # several blocks and a partial last block
+    deinterlacer.deinterlace(buffer, data, 4, 1001, data_order)
+
+    assert (data == reference(buffer, 4, data_order)).all()
+
+
+def test_deinterlace_in_parts():
+    buffer = numpy.arange(3 * 500, dtype="<u4")
+    data = numpy.zeros((3, 500), dtype="<u4")
+    deinterlacer = Deinterlacer()
+
+    # groups 0-199 then 200-499, as streaming deinterlace does
+    deinterlacer.deinterlace(buffer[: 3 * 200], data, 3, 500, [2, 0, 1])
+    deinterlacer.deinterlace(buffer[3 * 200 :], data, 3, 500, [2, 0, 1], start=200)
+
+    assert (data == reference(buffer, 3, [2, 0, 1])).all()
+
+
+def test_index_map_cache():
+    deinterlacer = Deinterlacer()
+
+    first = deinterlacer.get_index_map(4, 100, [3, 2, 1, 0])
+    assert deinterlacer.get_index_map(4, 100, [3, 2, 1, 0]) is first
+
+    # a new geometry replaces the cached map
+    deinterlacer.get_index_map(2, 200)
+    assert list(deinterlacer.index_maps) == [(2, 200, ())]
+
+
+def test_invalid_data_order():
+    with pytest.raises(azcam.AzcamError, match="Invalid data_order"):
+        Deinterlacer().get_index_map(2, 100, [3, 2, 1, 0])
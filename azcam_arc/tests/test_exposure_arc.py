@@ -0,0 +1,214 @@
+"""
+Tests of background receive and write of images in ExposureArc.
+"""
+
+import threading
+import time
+import types
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.camera_server import CameraServerInterface
+from azcam_arc.camserver_sim import CameraServerSimulator
+from azcam_arc.exposure_arc import ExposureArc
+from azcam_arc.receive_data import ReceiveData
+
+
+class Header(object):
+    """
+    Header with keywords in a dictionary.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.items = []
+
+    def set_keyword(self, keyword, value, comment="", typestring=None):
+        self.values[keyword] = value
+
+
+class Image(object):
+    """
+    Image which records what was written.
+    """
+
+    def __init__(self, focalplane, written):
+        self.header = Header()
+        self.focalplane = focalplane
+        self.data = numpy.zeros((focalplane.numamps_image, focalplane.numpix_amp))
+        self.valid = 0
+        self.written = written
+
+    def write_file(self, filename, filetype):
+        time.sleep(0.2)  # the next exposure starts meanwhile
+        self.written[filename] = (
+            dict(self.header.items[0].values),
+            self.focalplane.numcols_amp,
+            self.data.copy(),
+        )
+
+
+@pytest.fixture
+def exposure(monkeypatch):
+    camserver = CameraServerInterface()
+    camserver.demo_mode = 1
+    controller = types.SimpleNamespace(camserver=camserver, start_idle=lambda: None)
+    monkeypatch.setattr(azcam.db, "controller", controller, raising=False)
+    monkeypatch.setattr(azcam.db, "headers", {"exposure": Header()}, raising=False)
+
+    exposure = ExposureArc()
+    monkeypatch.setattr(azcam.db, "exposure", exposure, raising=False)
+
+    focalplane = types.SimpleNamespace(
+        numamps_image=2, numpix_amp=100, numpix_image=200, numcols_amp=10
+    )
+    exposure.written = {}
+    exposure.image = Image(focalplane, exposure.written)
+    exposure.receive_async = 1
+    exposure.save_file = 1
+    exposure.display_image = 0
+    exposure.send_image = 0
+    exposure.guide_mode = 0
+    exposure.flush_array = 1
+    exposure.exposure_time_actual = 1.0
+    exposure.dark_time = 1.0
+    exposure.increment_filenumber = lambda: None
+
+    return exposure
+
+
+def start_receive(exposure, value):
+    """
+    Start a background receive which fills the image with value.
+    """
+
+    def receive(*args, **kwargs):
+        time.sleep(0.1)
+        image.data.fill(value)
+
+    image = exposure.image
+    exposure.receive_data.receive_image_data = receive
+    exposure.receive_thread = threading.Thread(
+        target=exposure.receive_image_async, args=[image]
+    )
+    exposure.receive_thread.start()
+
+
+def test_end_async(exposure):
+    header = azcam.db.headers["exposure"]
+
+    for number in range(2):
+        exposure.wait_receive_async()  # as readout() does
+        header.values.clear()
+        header.set_keyword("OBJECT", f"object{number}")
+        exposure.image.header.items = [header]
+
+        start_receive(exposure, number + 1)
+        exposure.end_async(f"image{number}")
+
+        # the next exposure changes header and geometry while image is written
+        header.set_keyword("OBJECT", "next")
+        exposure.image.focalplane.numcols_amp = 20
+
+    exposure.wait_receive_async()
+
+    for number in range(2):
+        values, numcols_amp, data = exposure.written[f"image{number}"]
+        assert values["OBJECT"] == f"object{number}"
+        assert numcols_amp == 10 * (number + 1)
+        assert (data == number + 1).all()
+
+
+def test_swap_image_buffers(exposure):
+    image = exposure.image
+    focalplane = image.focalplane
+    image.focalplane = types.SimpleNamespace(**vars(focalplane))
+
+    exposure.swap_image_buffers(focalplane)
+
+    assert exposure.image_alternate is image
+    assert exposure.image.focalplane is focalplane
+    assert image.focalplane is not focalplane
+    assert exposure.image.data is not image.data
+    assert exposure.image.data.shape == image.data.shape
+
+
+def test_receive_error(exposure):
+    def receive(*args, **kwargs):
+        raise azcam.AzcamError("Received 10 of 400 bytes")
+
+    exposure.image.header.items = [azcam.db.headers["exposure"]]
+    exposure.receive_data.receive_image_data = receive
+    exposure.receive_thread = threading.Thread(
+        target=exposure.receive_image_async, args=[exposure.image]
+    )
+    exposure.receive_thread.start()
+    exposure.receive_thread.join()
+
+    with pytest.raises(azcam.AzcamError, match="Received 10"):
+        exposure.end_async("failed")
+
+    assert exposure.written == {}
+    exposure.wait_receive_async()
+
+
+def test_background_abort(monkeypatch):
+    exposure = types.SimpleNamespace(
+        exposure_flag=0, exposureflags={"ABORT": 2}, is_exposure_sequence=0
+    )
+    monkeypatch.setattr(azcam.db, "exposure", exposure, raising=False)
+    receive_data = ReceiveData(exposure)
+
+    # abort of the next exposure does not abort the background receive
+    receive_data.abort_event = threading.Event()
+    exposure.exposure_flag = 2
+    assert not receive_data.abort_requested()
+
+    receive_data.abort_event.set()
+    assert receive_data.abort_requested()
+
+    # without a background receive the exposure flag is used
+    receive_data.abort_event = None
+    assert receive_data.abort_requested()
+
+
+def test_mosaic_exposure_commands(monkeypatch):
+    sims = []
+    camservers = []
+    try:
+        for _ in range(3):
+            sim = CameraServerSimulator()
+            sim.start()
+            sims.append(sim)
+            camserver = CameraServerInterface()
+            camserver.set_server("localhost", sim.port)
+            camservers.append(camserver)
+
+        # the controller's own camera server is one of the mosaic camera servers
+        main = camservers[0]
+        controller = types.SimpleNamespace(
+            camserver=main,
+            exposure_time=2.5,
+            start_exposure=lambda: main.command("StartExposure"),
+            exposure_abort=lambda: main.command("AbortExposure"),
+        )
+        monkeypatch.setattr(azcam.db, "controller", controller, raising=False)
+        exposure = ExposureArc()
+        exposure.mosaic_camservers = camservers
+
+        exposure.start_exposure_mosaic()
+        exposure.command_mosaic("AbortExposure", controller.exposure_abort)
+    finally:
+        for camserver in camservers:
+            camserver.socketserver.close()
+        for sim in sims:
+            sim.stop()
+
+    for sim in sims:
+        assert sim.commands.count("StartExposure") == 1
+        assert sim.commands.count("AbortExposure") == 1
+    for sim in sims[1:]:
+        assert sim.parameters["ExposureTime"] == "2500"
@@ -0,0 +1,82 @@
+"""
+Tests of the QuickLook class.
+"""
+
+import types
+import uuid
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.quick_look import QuickLook
+
+NUMAMPS = 2
+NUMROWS = 40
+NUMCOLS = 30
+DATA_ORDER = [1, 0]
+
+
+def make_stream():
+    """
+    Return focalplane, data stream and the image rows it deinterlaces into.
+    """
+
+    focalplane = types.SimpleNamespace(numcols_amp=NUMCOLS, numrows_amp=NUMROWS)
+    stream = numpy.arange(NUMAMPS * NUMROWS * NUMCOLS, dtype="<u2")
+    image = stream.reshape(-1, NUMAMPS).T[DATA_ORDER]
+
+    return focalplane, stream, image.reshape(NUMAMPS, NUMROWS, NUMCOLS)
+
+
+def test_preview():
+    focalplane, stream, image = make_stream()
+    quick_look = QuickLook()
+    quick_look.row_step = 16
+
+    quick_look.start(focalplane, NUMAMPS, NUMROWS * NUMCOLS, DATA_ORDER)
+    assert quick_look.preview.shape == (NUMAMPS, 3, NUMCOLS)
+
+    # rows 0 and 16 are complete, row 32 is not
+    quick_look.update(stream, 20 * NUMCOLS)
+    assert quick_look.rows_ready == 2
+    assert (quick_look.get_preview() == image[:, [0, 16], :]).all()
+
+    quick_look.update(stream, NUMROWS * NUMCOLS)
+    assert quick_look.header[1] == 3
+    assert (quick_look.get_preview() == image[:, ::16, :]).all()
+
+    # a new readout starts again from the first row
+    quick_look.start(focalplane, NUMAMPS, NUMROWS * NUMCOLS, DATA_ORDER)
+    assert quick_look.get_preview().shape == (NUMAMPS, 0, NUMCOLS)
+    assert quick_look.header[0] == 2
+
+
+def test_unknown_layout():
+    quick_look = QuickLook()
+
+    quick_look.start(types.SimpleNamespace(), NUMAMPS, 1000)
+
+    assert quick_look.preview.shape == (NUMAMPS, 1, 1000)
+
+
+def test_shared():
+    focalplane, stream, image = make_stream()
+    quick_look = QuickLook()
+    quick_look.row_step = 8
+    quick_look.shared_name = f"azcamql{uuid.uuid4().hex[:8]}"
+
+    try:
+        quick_look.start(focalplane, NUMAMPS, NUMROWS * NUMCOLS, DATA_ORDER)
+        quick_look.update(stream, NUMROWS * NUMCOLS)
+
+        shm, header, preview = QuickLook.attach(quick_look.shared_name)
+        try:
+            assert list(header[:6]) == [1, 5, NUMAMPS, 5, NUMCOLS, 8]
+            assert (preview == image[:, ::8, :]).all()
+            del header, preview
+        finally:
+            shm.close()
+    finally:
+        quick_look.close()
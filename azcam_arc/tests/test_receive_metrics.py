@@ -0,0 +1,56 @@
+"""
+Tests of the ReceiveMetrics class.
+"""
+
+import json
+import time
+
+from azcam_arc.receive_metrics import ReceiveMetrics
+
+
+def test_metrics():
+    metrics = ReceiveMetrics()
+    readout_start_time = time.perf_counter() - 0.5
+    metrics.reset(3000, readout_start_time)
+
+    for nbytes in [1000, 1500, 500]:
+        metrics.add_chunk(nbytes)
+    metrics.retries = 2
+    metrics.finish(0.25)
+
+    values = metrics.get_metrics()
+    assert values["data_size"] == 3000
+    assert values["bytes_received"] == 3000
+    assert values["chunks"] == 3
+    assert values["chunk_bytes"] == [1000, 1500, 500]
+    assert len(values["chunk_latency"]) == 3
+    assert values["retries"] == 2
+    assert values["first_byte_time"] >= 0.5
+    assert values["deinterlace_time"] == 0.25
+    assert values["transfer_time"] > 0
+    assert values["mbytes_per_sec"] > 0
+
+
+def test_no_data():
+    metrics = ReceiveMetrics()
+    metrics.reset(3000)
+    metrics.finish()
+
+    values = metrics.get_metrics()
+    assert values["chunks"] == 0
+    assert values["transfer_time"] == 0.0
+    assert values["mbytes_per_sec"] == 0.0
+
+
+def test_write(tmp_path):
+    filename = tmp_path / "metrics.jsonl"
+    metrics = ReceiveMetrics()
+
+    for size in [100, 200]:
+        metrics.reset(size)
+        metrics.add_chunk(size)
+        metrics.finish()
+        metrics.write(filename)
+
+    lines = filename.read_text().splitlines()
+    assert [json.loads(line)["bytes_received"] for line in lines] == [100, 200]
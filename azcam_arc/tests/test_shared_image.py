@@ -0,0 +1,82 @@
+"""
+Tests of the SharedImage class.
+"""
+
+import types
+import uuid
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.shared_image import (
+    SharedImage,
+    attach_shared_memory,
+    close_shared_memory,
+    create_shared_memory,
+)
+
+
+@pytest.fixture
+def shared_image():
+    shared_image = SharedImage()
+    shared_image.shared_name = f"azcamtest{uuid.uuid4().hex[:8]}"
+    yield shared_image
+    shared_image.close()
+
+
+def make_image():
+    focalplane = types.SimpleNamespace(
+        numamps_image=2, numpix_amp=600, numcols_amp=30, numrows_amp=20
+    )
+
+    return types.SimpleNamespace(
+        focalplane=focalplane, data=numpy.zeros((2, 600), dtype="<u2")
+    )
+
+
+def test_publish(shared_image):
+    image = make_image()
+    shared_image.publish(image, "test.1")
+    image.data[:] = numpy.arange(1200).reshape(2, 600)
+
+    shm, descriptor, data = SharedImage.attach(shared_image.shared_name)
+    try:
+        assert descriptor["exposure_id"] == "test.1"
+        assert descriptor["state"] == "readout"
+        assert descriptor["shape"] == [2, 600]
+        assert descriptor["numcols_amp"] == 30
+        assert (data == image.data).all()
+
+        shared_image.set_state("complete")
+        assert SharedImage.read_descriptor(shm)["state"] == "complete"
+
+        # the next image is published in the same block
+        shared_image.publish(image, "test.2")
+        assert SharedImage.read_descriptor(shm)["frame"] == 2
+        del data
+    finally:
+        shm.close()
+
+
+def test_descriptor_timeout(shared_image):
+    shm = create_shared_memory(shared_image.shared_name, SharedImage.DESCRIPTOR_BYTES)
+    try:
+        with pytest.raises(azcam.AzcamError, match="not available"):
+            SharedImage.read_descriptor(shm, 0.05)
+    finally:
+        close_shared_memory(shm)
+
+
+def test_leftover_block(shared_image):
+    # a block left over from an earlier process is replaced
+    old = create_shared_memory(shared_image.shared_name, 100)
+    try:
+        shared_image.publish(make_image())
+
+        shm = attach_shared_memory(shared_image.shared_name)
+        assert shm.size >= SharedImage.DESCRIPTOR_BYTES + 2400
+        shm.close()
+    finally:
+        old.close()
@@ -0,0 +1,82 @@
+"""
+Tests of the SyntheticImage class.
+"""
+
+import types
+
+import numpy
+import pytest
+
+azcam = pytest.importorskip("azcam")
+
+from azcam_arc.synthetic_image import SyntheticImage
+
+
+def make_image(numamps=2, numrows=50, numcols=60, overscan=10):
+    """
+    Return an image of numamps amplifiers with overscan columns.
+    """
+
+    focalplane = types.SimpleNamespace(
+        numamps_image=numamps,
+        numpix_amp=numrows * numcols,
+        numrows_amp=numrows,
+        numcols_amp=numcols,
+        numcols_overscan=overscan,
+    )
+
+    return types.SimpleNamespace(
+        focalplane=focalplane,
+        data=numpy.zeros((numamps, numrows * numcols), dtype="<u2"),
+    )
+
+
+def test_geometry():
+    image = make_image()
+    synthetic_image = SyntheticImage()
+
+    numamps, numrows, numcols, datacols, datarows = synthetic_image.get_geometry(
+        image.focalplane
+    )
+    assert (numamps, numrows, numcols) == (2, 50, 60)
+    assert (datacols, datarows) == (slice(0, 50), slice(0, 50))
+
+    # unknown layout is one row per amplifier
+    image.focalplane.numrows_amp = 0
+    assert synthetic_image.get_geometry(image.focalplane)[1:3] == (1, 3000)
+
+
+def test_make_image():
+    image = make_image()
+    synthetic_image = SyntheticImage()
+    synthetic_image.num_stars = 0
+
+    synthetic_image.make_image(image, "object", 10.0)
+
+    data = image.data.reshape(2, 50, 60).astype(float)
+    bias = data[:, :, 50:]
+    sky = data[:, :, :50]
+    for amp in range(2):
+        level = synthetic_image.bias_level + amp * synthetic_image.bias_step
+        assert abs(bias[amp].mean() - level) < 1.0
+        assert abs(bias[amp].std() - synthetic_image.read_noise) < 1.0
+        assert sky[amp].mean() > level + 900
+
+    # noise-free frame is reused for the same geometry, type and time
+    base = synthetic_image.base
+    synthetic_image.make_image(image, "object", 10.0)
+    assert synthetic_image.base is base
+    synthetic_image.make_image(image, "zero", 0.0)
+    assert synthetic_image.base is not base
+
+
+def test_no_wrap():
+    image = make_image()
+    synthetic_image = SyntheticImage()
+    synthetic_image.bias_level = 0.0
+    synthetic_image.bias_step = 0.0
+
+    synthetic_image.make_image(image, "zero", 0.0)
+
+    # noise below zero bias must not wrap to 65535
+    assert image.data.max() <= 16 * synthetic_image.read_noise